@@ -1,31 +1,36 @@
 import asyncio
-import time
-from aiogram import Bot, Dispatcher, types
+import uuid
+from aiogram import Bot, Dispatcher
+from aiogram.exceptions import TelegramNetworkError, TelegramRetryAfter, TelegramServerError
 from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.fsm.storage.redis import RedisStorage
 from aiogram.fsm.strategy import FSMStrategy
-from aiogram.fsm.context import FSMContext
-from aiogram.filters import Command
 
-from app.config import TELEGRAM_BOT_TOKEN
+from app.config import TELEGRAM_BOT_TOKEN, REDIS_URL, FSM_STATE_TTL, FSM_DATA_TTL
 from app.db import init_db, close_db
+from app.handlers import register_handlers
 from app.utils.logging_config import logger
+from app.utils.backoff import with_backoff
 
-# Initialize bot and dispatcher
-bot = Bot(token=TELEGRAM_BOT_TOKEN)
-
-# Use a unique session name to prevent conflicts
-session_name = f"bot_{int(time.time())}"
-logger.info(f"Starting bot with session: {session_name}")
+# Transient Telegram failures worth restarting polling for; anything else (e.g. a bad token) is fatal
+POLLING_RETRY_ON = (TelegramNetworkError, TelegramServerError, TelegramRetryAfter)
 
-storage = MemoryStorage()
-dp = Dispatcher(
-    storage=storage,
-    fsm_strategy=FSMStrategy.USER_IN_CHAT,
-    name=session_name  # Add a unique name for this session
-)
+def build_dispatcher() -> Dispatcher:
+    """Create the dispatcher and its FSM storage (done in main(), not at import time)"""
+    # Use a unique session name to prevent conflicts
+    session_name = f"bot_{uuid.uuid4().hex[:8]}"
+    logger.info("Starting bot with session: %s", session_name)
 
-# Register handlers
-from app.handlers import register_handlers
+    # Redis-backed FSM storage survives restarts and is shared between bot instances
+    if REDIS_URL:
+        storage = RedisStorage.from_url(REDIS_URL, state_ttl=FSM_STATE_TTL, data_ttl=FSM_DATA_TTL)
+    else:
+        storage = MemoryStorage()
+    return Dispatcher(
+        storage=storage,
+        fsm_strategy=FSMStrategy.USER_IN_CHAT,
+        name=session_name  # Add a unique name for this session
+    )
 
 async def on_startup():
     """Actions to perform on bot startup"""
@@ -33,15 +38,20 @@ async def on_startup():
     await init_db()
     logger.info("Bot started successfully")
 
-async def on_shutdown():
+async def on_shutdown(bot: Bot, dp: Dispatcher):
     """Actions to perform on bot shutdown"""
     logger.info("Shutting down Memoria Bot...")
     await close_db()
     await dp.storage.close()
+    await bot.session.close()
     logger.info("Bot shut down successfully")
 
 async def main():
     """Main function to run the bot"""
+    # Initialize bot and dispatcher
+    bot = Bot(token=TELEGRAM_BOT_TOKEN)
+    dp = build_dispatcher()
+
     # Register handlers
     register_handlers(dp)
     
@@ -52,20 +62,29 @@ async def main():
         # Delete any existing webhook
         await bot.delete_webhook(drop_pending_updates=True)
         
-        # Start polling with explicit parameters
-        await dp.start_polling(
+        # Start polling with explicit parameters; restart it with jittered backoff on transient errors
+        await with_backoff(
+            dp.start_polling,
             bot,
             skip_updates=True,
             allowed_updates=dp.resolve_used_update_types(),
-            drop_pending_updates=True
+            drop_pending_updates=True,
+            retry_on=POLLING_RETRY_ON,
         )
     except Exception as e:
-        logger.error(f"Error in polling: {e}")
+        logger.error("Error in polling: %s", e)
         raise
     finally:
-        await on_shutdown()
+        await on_shutdown(bot, dp)
 
 if __name__ == "__main__":
+    # libuv-based event loop for aiogram polling and asyncpg, if installed (not available on Windows)
+    try:
+        import uvloop
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    except ImportError:
+        pass
+
     try:
         asyncio.run(main())
     except KeyboardInterrupt:
@@ -22,6 +22,16 @@ POSTGRES_PORT = os.getenv("POSTGRES_PORT", "5432")
 DATABASE_URL = os.getenv("DATABASE_URL") or \
     f"postgres://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_HOST}:{POSTGRES_PORT}/{POSTGRES_DB}"
 
+# asyncpg pool (raw SQL hot paths)
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "10"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "50"))
+DB_POOL_MAX_INACTIVE_LIFETIME = float(os.getenv("DB_POOL_MAX_INACTIVE_LIFETIME", "300"))  # Seconds
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "1024"))
+
+# Tortoise's own asyncpg pool (ORM queries, import script)
+TORTOISE_POOL_MIN_SIZE = int(os.getenv("TORTOISE_POOL_MIN_SIZE", "5"))
+TORTOISE_POOL_MAX_SIZE = int(os.getenv("TORTOISE_POOL_MAX_SIZE", "25"))
+
 # Tortoise ORM
 TORTOISE_ORM = {
     "connections": {"default": DATABASE_URL},
@@ -33,6 +43,11 @@ TORTOISE_ORM = {
     },
 }
 
+# Redis (FSM storage). Leave REDIS_URL unset to keep FSM state in process memory.
+REDIS_URL = os.getenv("REDIS_URL")
+FSM_STATE_TTL = int(os.getenv("FSM_STATE_TTL", "3600"))  # Seconds
+FSM_DATA_TTL = int(os.getenv("FSM_DATA_TTL", "86400"))  # Seconds
+
 # OpenAI
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-3-small")
@@ -1,6 +1,9 @@
+import asyncio
 import os
-from typing import Optional
+from typing import Dict, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
 from tortoise import Tortoise
+from tortoise.backends.base.config_generator import expand_db_url
 from tortoise.expressions import F
 
 from app.config import (
@@ -11,28 +14,149 @@ from app.config import (
     POSTGRES_HOST,
     POSTGRES_PORT,
     EMBEDDING_DIM,
+    TORTOISE_POOL_MIN_SIZE,
+    TORTOISE_POOL_MAX_SIZE,
 )
+from app.db.pool import init_pool, close_pool
+from app.utils.logging_config import logger
 
 # Check if we should use DATABASE_URL or build it from components
 if not DATABASE_URL:
     DATABASE_URL = f"postgres://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_HOST}:{POSTGRES_PORT}/{POSTGRES_DB}"
 
-async def init_db():
-    """Initialize database connection and set up pgvector extension"""
-    await Tortoise.init(
-        db_url=DATABASE_URL,
-        modules={"models": ["app.models.db_models"]},
-    )
-    
-    # Enable pgvector extension if not already enabled
+# Keeps messages.chunked in sync with chunks_messages so "unchunked messages in chat X" is answered
+# from the partial index below instead of an anti-join over the chat's whole history.
+# Statement-level triggers with transition tables also cover COPY and multi-row INSERTs.
+CHUNKED_FLAG_SQL = """
+ALTER TABLE messages ADD COLUMN IF NOT EXISTS chunked BOOLEAN NOT NULL DEFAULT false;
+ALTER TABLE messages ALTER COLUMN chunked SET DEFAULT false;
+
+CREATE INDEX IF NOT EXISTS idx_messages_chat_date_unchunked ON messages (chat_id, date) WHERE NOT chunked;
+
+CREATE OR REPLACE FUNCTION messages_mark_chunked() RETURNS trigger AS $$
+BEGIN
+    UPDATE messages m SET chunked = true
+    FROM (SELECT DISTINCT message_id FROM new_links) n
+    WHERE m.id = n.message_id AND NOT m.chunked;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION messages_unmark_chunked() RETURNS trigger AS $$
+BEGIN
+    UPDATE messages m SET chunked = false
+    FROM (SELECT DISTINCT message_id FROM old_links) o
+    WHERE m.id = o.message_id
+      AND NOT EXISTS (SELECT 1 FROM chunks_messages cm WHERE cm.message_id = o.message_id);
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS chunks_messages_mark_chunked ON chunks_messages;
+CREATE TRIGGER chunks_messages_mark_chunked
+    AFTER INSERT ON chunks_messages REFERENCING NEW TABLE AS new_links
+    FOR EACH STATEMENT EXECUTE FUNCTION messages_mark_chunked();
+
+DROP TRIGGER IF EXISTS chunks_messages_unmark_chunked ON chunks_messages;
+CREATE TRIGGER chunks_messages_unmark_chunked
+    AFTER DELETE ON chunks_messages REFERENCING OLD TABLE AS old_links
+    FOR EACH STATEMENT EXECUTE FUNCTION messages_unmark_chunked();
+
+-- Backfill rows linked before the flag existed; only walks the (small) unchunked set
+UPDATE messages m SET chunked = true
+WHERE NOT m.chunked AND EXISTS (SELECT 1 FROM chunks_messages cm WHERE cm.message_id = m.id);
+"""
+
+# FP16 copy of chunk embeddings: half the bytes per similarity comparison and a smaller HNSW index.
+# The column add/backfill covers databases created before ChunkEmbedding.embedding_h existed.
+HALFVEC_SQL = """
+ALTER TABLE chunks ADD COLUMN IF NOT EXISTS embedding_h halfvec(1536);
+UPDATE chunks SET embedding_h = embedding::halfvec WHERE embedding_h IS NULL AND embedding IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_chunks_embedding_h_hnsw ON chunks USING hnsw (embedding_h halfvec_cosine_ops)
+    WITH (m = 16, ef_construction = 64);
+
+-- btree that ChunkEmbedding.Meta.indexes = ["embedding"] used to generate: useless for
+-- similarity search and it fails on real 1536-dim rows
+DROP INDEX IF EXISTS idx_chunks_embeddi_a31ca7;
+"""
+
+# Everything init_db() runs after generate_schemas(). Tortoise only indexes (chunks_id, message_id)
+# on the join table; the chunked-flag triggers look rows up by message_id alone.
+SETUP_SQL = (
+    "CREATE INDEX IF NOT EXISTS idx_chunks_messages_message_id ON chunks_messages (message_id);\n"
+    + CHUNKED_FLAG_SQL
+    + HALFVEC_SQL
+)
+
+# Whether pgvector is installed, per (host, port, database): stable for the life of the process
+_vector_installed_cache: Dict[Tuple, bool] = {}
+_vector_installed_lock = asyncio.Lock()
+
+def _db_key(conn) -> Tuple:
+    return (getattr(conn, "host", None), getattr(conn, "port", None), getattr(conn, "database", None))
+
+async def _vector_installed(conn) -> bool:
+    """Whether the pgvector extension is installed in conn's database (queried once per database)"""
+    key = _db_key(conn)
+    async with _vector_installed_lock:
+        if key not in _vector_installed_cache:
+            # pg_extension is a plain catalog lookup; pg_available_extensions reads the extension dir.
+            # (shared_preload_libraries can't answer this: pgvector is loaded on demand, never preloaded).
+            # Run straight on the asyncpg connection, skipping execute_query()'s logging and row wrapping.
+            async with conn.acquire_connection() as raw:
+                version = await raw.fetchval("SELECT extversion FROM pg_extension WHERE extname = 'vector'")
+            _vector_installed_cache[key] = version is not None
+        return _vector_installed_cache[key]
+
+def get_tortoise_config() -> dict:
+    """Tortoise config for DATABASE_URL, with the asyncpg pool sized from the TORTOISE_POOL_* settings"""
+    connection = expand_db_url(DATABASE_URL)
+    # expand_db_url() replaces a "?host=/socket/dir" param (Unix socket DSN) with the empty URL hostname
+    if connection["engine"] == "tortoise.backends.asyncpg" and not connection["credentials"].get("host"):
+        socket_dir = parse_qs(urlsplit(DATABASE_URL).query).get("host")
+        if socket_dir:
+            connection["credentials"]["host"] = socket_dir[-1]
+    # Pool sizes go into credentials: asyncpg would reject them as URL query params (server settings)
+    if connection["engine"] == "tortoise.backends.asyncpg":
+        connection["credentials"].update(minsize=TORTOISE_POOL_MIN_SIZE, maxsize=TORTOISE_POOL_MAX_SIZE)
+    return {
+        "connections": {"default": connection},
+        "apps": {
+            "models": {
+                "models": ["app.models.db_models"],
+                "default_connection": "default",
+            },
+        },
+    }
+
+async def init_db(create_schema: bool = True):
+    """
+    Initialize database connection and set up pgvector extension and the schema.
+    Pass create_schema=False to skip the schema, e.g. for a database cloned from a template.
+    """
+    await Tortoise.init(config=get_tortoise_config())
     conn = Tortoise.get_connection("default")
-    await conn.execute_query("CREATE EXTENSION IF NOT EXISTS vector")
-    
-    # Generate the schema
-    await Tortoise.generate_schemas(safe=True)
+
+    # Enable pgvector extension if not already enabled (even without create_schema:
+    # the asyncpg pool registers the vector codecs on every connection)
+    if not await _vector_installed(conn):
+        logger.info("pgvector extension not installed, creating it")
+        await conn.execute_query("CREATE EXTENSION IF NOT EXISTS vector")
+        _vector_installed_cache[_db_key(conn)] = True
+
+    if create_schema:
+        # Generate the schema
+        await Tortoise.generate_schemas(safe=True)
+
+        # Post-schema DDL, sent as one multi-statement script (one round trip)
+        await conn.execute_script(SETUP_SQL)
+
+    # Raw asyncpg pool for the chunking hot path
+    await init_pool(DATABASE_URL)
 
 async def close_db():
     """Close database connections"""
+    await close_pool()
     await Tortoise.close_connections()
 
 def get_db_url() -> str:
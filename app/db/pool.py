@@ -0,0 +1,60 @@
+from typing import Optional
+
+import asyncpg
+import orjson
+from pgvector.asyncpg import register_vector
+
+from app.config import (
+    DB_POOL_MIN_SIZE,
+    DB_POOL_MAX_SIZE,
+    DB_POOL_MAX_INACTIVE_LIFETIME,
+    DB_STATEMENT_CACHE_SIZE,
+)
+
+# Shared asyncpg pool used by the raw-SQL hot paths (chunking).
+# Tortoise keeps its own connections and stays responsible for the schema.
+_pool: Optional[asyncpg.Pool] = None
+
+def _orjson_dumps(value) -> str:
+    return orjson.dumps(value).decode()
+
+async def _init_connection(conn: asyncpg.Connection):
+    """
+    Decode json/jsonb columns into Python objects with orjson, like Tortoise's JSONField does
+    when orjson is installed, and use pgvector's binary codecs (lists/numpy arrays in, Vector/HalfVector out).
+    """
+    for typename in ("json", "jsonb"):
+        await conn.set_type_codec(
+            typename,
+            encoder=_orjson_dumps,
+            decoder=orjson.loads,
+            schema="pg_catalog",
+        )
+    await register_vector(conn)
+
+async def init_pool(dsn: str) -> asyncpg.Pool:
+    """Create the shared asyncpg pool (no-op if it already exists)"""
+    global _pool
+    if _pool is None:
+        _pool = await asyncpg.create_pool(
+            dsn,
+            min_size=DB_POOL_MIN_SIZE,
+            max_size=DB_POOL_MAX_SIZE,
+            max_inactive_connection_lifetime=DB_POOL_MAX_INACTIVE_LIFETIME,
+            statement_cache_size=DB_STATEMENT_CACHE_SIZE,
+            init=_init_connection,
+        )
+    return _pool
+
+def get_pool() -> asyncpg.Pool:
+    """Return the shared asyncpg pool, failing loudly if init_db() was not called"""
+    if _pool is None:
+        raise RuntimeError("asyncpg pool is not initialized, call init_db() first")
+    return _pool
+
+async def close_pool():
+    """Close the shared asyncpg pool"""
+    global _pool
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
@@ -1,5 +1,5 @@
 import logging
-from aiogram import types, F, Router, Dispatcher
+from aiogram import types, Router, Dispatcher
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 
@@ -11,7 +11,9 @@ router = Router()
 logger = logging.getLogger(__name__)
 
 def register_handlers(dispatcher: Dispatcher):
-    """Register all base command and message handlers"""
+    """Register all base command and message handlers (idempotent: the router can only be attached once)"""
+    if router in dispatcher.sub_routers:
+        return
     dispatcher.include_router(router)
 
 @router.message(Command("start", "help"))
@@ -42,5 +44,5 @@ async def handle_message(message: types.Message, state: FSMContext):
         if response:
             await message.answer(response)
     except Exception as e:
-        logger.error(f"Error processing message: {e}", exc_info=True)
+        logger.error("Error processing message: %s", e, exc_info=True)
         #await message.answer("Sorry, I encountered an error processing your message. Please try again later.")
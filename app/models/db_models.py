@@ -1,6 +1,14 @@
 from tortoise import fields, models
 from tortoise_vector.field import VectorField
 
+
+class HalfVecField(VectorField):
+    """pgvector `halfvec` (FP16) column: same text format as VectorField at half the storage (needs pgvector >= 0.7)"""
+
+    @property
+    def SQL_TYPE(self) -> str:
+        return f"{self._schema}halfvec({self._vector_size})"
+
 # chats: id type title username
 class Chat(models.Model):
     id = fields.BigIntField(pk=True)
@@ -46,6 +54,9 @@ class Message(models.Model):
     # Reply field
     reply_to_message = fields.ForeignKeyField('models.Message', related_name='replies', null=True, db_constraint=False)
 
+    # Set by a trigger on chunks_messages (see app.db), backs the partial "unchunked" index
+    chunked = fields.BooleanField(default=False)
+
     class Meta:
         table = "messages"
         indexes = [
@@ -73,15 +84,18 @@ class ChunkEmbedding(models.Model):
     chat = fields.ForeignKeyField('models.Chat', related_name='chunks', null=False)  # Direct link to chat
     chunk_text = fields.TextField(null=True)
     embedding = VectorField(vector_size=1536, null=True)
+    embedding_h = HalfVecField(vector_size=1536, null=True)  # FP16 copy used for similarity search
     from_time = fields.FloatField(null=True)
     to_time = fields.FloatField(null=True)
-    messages = fields.ManyToManyField('models.Message', related_name='chunks')
-    users = fields.ManyToManyField('models.User', related_name='chunks')
-    medias = fields.ManyToManyField('models.Media', related_name='chunks')
+    # Join tables are named explicitly because the chunking service writes to them with raw SQL
+    messages = fields.ManyToManyField('models.Message', related_name='chunks', through='chunks_messages', backward_key='chunks_id', forward_key='message_id')
+    users = fields.ManyToManyField('models.User', related_name='chunks', through='chunks_users', backward_key='chunks_id', forward_key='user_id')
+    medias = fields.ManyToManyField('models.Media', related_name='chunks', through='chunks_media', backward_key='chunks_id', forward_key='media_id')
 
     class Meta:
         table = "chunks"
-        indexes = ["embedding"]  # This enables pgvector indexing
+        # No Meta.indexes here: a plain btree on a vector can't serve similarity search and rejects
+        # 1536-dim rows (too large for a btree entry). The HNSW index is created in init_db().
 
     def __str__(self):
-        return f"Chunk {self.id}: {self.text[:50]}..."
\ No newline at end of file
+        return f"Chunk {self.id}: {(self.chunk_text or '')[:50]}..."
\ No newline at end of file
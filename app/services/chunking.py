@@ -1,95 +1,224 @@
-from datetime import datetime
-from typing import List, Dict, Any, Optional, Tuple
+import asyncio
+from types import SimpleNamespace
+from typing import List, Optional, Tuple
+
+import asyncpg
 
-from app.models.db_models import Message
 from app.config import CHUNK_SIZE, CHUNK_OVERLAP
-from app.models.db_models import ChunkEmbedding, User, Media
-from tortoise.functions import Count
-from app.utils.logging_config import logger, log_exception, log_function_call
-
-async def get_unchunked_messages(chat_id: int) -> List[str]:
-    """Return formatted messages in a chat not yet associated with any chunk, ordered by date."""
-    messages = await Message.filter(chat_id=chat_id)\
-        .annotate(num_chunks=Count("chunks"))\
-        .filter(num_chunks=0)\
-        .order_by("date")\
-        .prefetch_related(\
-            'from_user',\
-            'chat',\
-            'forward_from_user',\
-            'forward_from_chat',\
-            'reply_to_message',\
-            'reply_to_message__from_user',\
-            'media'\
-        )\
-        .all()
+from app.db.pool import get_pool
+from app.utils.logging_config import logger, log_function_call
+from app.utils.message_formatting import format_message_for_display
+
+# Above this many messages, formatting is moved off the event loop into a worker thread
+FORMAT_IN_THREAD_THRESHOLD = 500
+
+# Everything format_message_for_display() needs, with all relations joined in a single round-trip
+_MESSAGE_SELECT = """
+    SELECT m.id, m.date, m.text, m.entities, m.forward_sender_name, m.media_id,
+           m.from_user_id, u.username AS from_username,
+           u.first_name AS from_first_name, u.last_name AS from_last_name,
+           m.forward_from_user_id, fu.username AS fwd_username,
+           fu.first_name AS fwd_first_name, fu.last_name AS fwd_last_name,
+           m.forward_from_chat_id, fc.title AS fwd_chat_title,
+           r.id AS reply_id, r.from_user_id AS reply_user_id, ru.username AS reply_username,
+           ru.first_name AS reply_first_name, ru.last_name AS reply_last_name,
+           md.media_type
+    FROM messages m
+    LEFT JOIN users u ON u.id = m.from_user_id
+    LEFT JOIN users fu ON fu.id = m.forward_from_user_id
+    LEFT JOIN chats fc ON fc.id = m.forward_from_chat_id
+    LEFT JOIN messages r ON r.id = m.reply_to_message_id
+    LEFT JOIN users ru ON ru.id = r.from_user_id
+    LEFT JOIN media md ON md.file_unique_id = m.media_id
+"""
+
+# Served by the partial (chat_id, date) WHERE NOT chunked index created in init_db()
+_UNCHUNKED_MESSAGES_SQL = _MESSAGE_SELECT + """
+    WHERE m.chat_id = $1 AND NOT m.chunked
+    ORDER BY m.date
+"""
+
+# Sliding-window check and fetch in one round-trip. Returns the last $2 messages of the chat when
+# a new chunk is due, no rows otherwise:
+#   - with an existing chunk: once at least $3 messages arrived after its last message
+#   - without one: once the chat holds a full window of $2 messages
+# Both counts are capped with LIMIT so they never scan more than the threshold.
+_REFRESH_WINDOW_SQL = """
+    WITH latest AS (
+        SELECT id FROM chunks WHERE chat_id = $1 ORDER BY to_time DESC NULLS LAST LIMIT 1
+    ), last_date AS (
+        SELECT max(lm.date) AS d
+        FROM chunks_messages lcm
+        JOIN messages lm ON lm.id = lcm.message_id
+        WHERE lcm.chunks_id = (SELECT id FROM latest)
+    ), due AS (
+        SELECT CASE
+            WHEN NOT EXISTS (SELECT 1 FROM latest) THEN
+                (SELECT count(*) FROM (SELECT 1 FROM messages WHERE chat_id = $1 LIMIT $2) a) >= $2
+            WHEN (SELECT d FROM last_date) IS NULL THEN false
+            ELSE
+                (SELECT count(*) FROM (
+                    SELECT 1 FROM messages WHERE chat_id = $1 AND date > (SELECT d FROM last_date) LIMIT $3
+                ) b) >= $3
+        END AS ok
+    )
+""" + _MESSAGE_SELECT + """
+    WHERE m.chat_id = $1 AND (SELECT ok FROM due)
+    ORDER BY m.date DESC
+    LIMIT $2
+"""
+
+# Windows are inserted in order, so the ascending ids returned map 1:1 onto the windows
+_INSERT_CHUNKS_SQL = """
+    INSERT INTO chunks (chat_id, chunk_text, from_time, to_time)
+    SELECT $1, t.chunk_text, t.from_time, t.to_time
+    FROM unnest($2::text[], $3::float8[], $4::float8[]) WITH ORDINALITY AS t(chunk_text, from_time, to_time, ord)
+    ORDER BY t.ord
+    RETURNING id
+"""
+
+
+def _user_from_row(user_id: Optional[int], username: Optional[str], first_name: Optional[str], last_name: Optional[str]):
+    """Build a lightweight stand-in for a User row (same attributes format_username() reads)."""
+    if user_id is None:
+        return None
+    fn = first_name or ''
+    ln = last_name or ''
+    return SimpleNamespace(
+        id=user_id,
+        username=username,
+        first_name=first_name,
+        last_name=last_name,
+        full_name=(fn + (' ' + ln if ln else '')).strip(),
+    )
+
+def _message_from_row(row: asyncpg.Record) -> SimpleNamespace:
+    """Turn a _MESSAGE_SELECT row into an object format_message_for_display() can consume."""
+    reply_to_message = None
+    if row['reply_id'] is not None:
+        reply_to_message = SimpleNamespace(
+            id=row['reply_id'],
+            from_user=_user_from_row(row['reply_user_id'], row['reply_username'], row['reply_first_name'], row['reply_last_name']),
+        )
+    forward_from_chat = None
+    if row['forward_from_chat_id'] is not None:
+        forward_from_chat = SimpleNamespace(id=row['forward_from_chat_id'], title=row['fwd_chat_title'])
+    media = None
+    if row['media_id'] is not None:
+        media = SimpleNamespace(file_unique_id=row['media_id'], media_type=row['media_type'])
+    return SimpleNamespace(
+        id=row['id'],
+        date=row['date'],
+        text=row['text'],
+        entities=row['entities'],
+        forward_sender_name=row['forward_sender_name'],
+        from_user_id=row['from_user_id'],
+        from_user=_user_from_row(row['from_user_id'], row['from_username'], row['from_first_name'], row['from_last_name']),
+        forward_from_user=_user_from_row(row['forward_from_user_id'], row['fwd_username'], row['fwd_first_name'], row['fwd_last_name']),
+        forward_from_chat=forward_from_chat,
+        reply_to_message=reply_to_message,
+        media_id=row['media_id'],
+        media=media,
+    )
+
+async def _create_chunks(conn: asyncpg.Connection, chat_id: int, windows: List[Tuple[List[SimpleNamespace], str]]) -> List[int]:
+    """
+    Insert chunks for (messages, chunk_text) windows plus their message/user/media links.
+    Uses one statement per table regardless of the number of windows. Caller owns the transaction.
+    Returns the new chunk ids in window order.
+    """
+    rows = await conn.fetch(
+        _INSERT_CHUNKS_SQL,
+        chat_id,
+        [text for _, text in windows],
+        [msgs[0].date.timestamp() for msgs, _ in windows],
+        [msgs[-1].date.timestamp() for msgs, _ in windows],
+    )
+    chunk_ids = sorted(r['id'] for r in rows)
+
+    message_links, user_links, media_links = [], [], []
+    for chunk_id, (chunk_msgs, _) in zip(chunk_ids, windows):
+        message_links.extend((chunk_id, m.id) for m in chunk_msgs)
+        # dict.fromkeys keeps first-seen order while dropping duplicates (the join tables are unique)
+        user_links.extend((chunk_id, uid) for uid in dict.fromkeys(m.from_user_id for m in chunk_msgs if m.from_user_id is not None))
+        media_links.extend((chunk_id, mid) for mid in dict.fromkeys(m.media_id for m in chunk_msgs if m.media_id is not None))
+
+    # Binary COPY skips per-row parse/plan, so link rows cost about the same as raw bytes
+    await conn.copy_records_to_table('chunks_messages', records=message_links, columns=('chunks_id', 'message_id'))
+    if user_links:
+        await conn.copy_records_to_table('chunks_users', records=user_links, columns=('chunks_id', 'user_id'))
+    if media_links:
+        await conn.copy_records_to_table('chunks_media', records=media_links, columns=('chunks_id', 'media_id'))
+    return chunk_ids
+
+async def _fetch_unchunked(conn: asyncpg.Connection, chat_id: int) -> List[SimpleNamespace]:
+    """Fetch messages in a chat not yet associated with any chunk, ordered by date."""
+    rows = await conn.fetch(_UNCHUNKED_MESSAGES_SQL, chat_id)
+    return [_message_from_row(r) for r in rows]
+
+def _format_messages(messages: List[SimpleNamespace]) -> List[str]:
     return [format_message_for_display(m) for m in messages]
 
+async def get_unchunked_messages(chat_id: int, conn: Optional[asyncpg.Connection] = None) -> Tuple[List[SimpleNamespace], List[str]]:
+    """
+    Return messages in a chat not yet associated with any chunk, ordered by date,
+    together with their formatted display strings (same order).
+    Uses `conn` when given, otherwise borrows a pool connection for the query.
+    """
+    if conn is None:
+        async with get_pool().acquire() as conn:
+            messages = await _fetch_unchunked(conn, chat_id)
+    else:
+        messages = await _fetch_unchunked(conn, chat_id)
+    if len(messages) > FORMAT_IN_THREAD_THRESHOLD:
+        # Large backlogs would otherwise stall the event loop (and Telegram polling) while formatting
+        formatted = await asyncio.to_thread(_format_messages, messages)
+    else:
+        formatted = _format_messages(messages)
+    return messages, formatted
+
 def get_chunk_windows(total: int, size: int, overlap: int):
     """Yield (start, end) indices for chunking with overlap."""
     step = max(1, size - overlap)
     for idx in range(0, total - size + 1, step):
         yield idx, idx + size
 
-from app.utils.message_formatting import format_message_for_display
+async def auto_chunk_chat(chat_id: int, conn: Optional[asyncpg.Connection] = None):
+    """
+    Create new chunks for a chat from unchunked messages, using configured size and overlap.
+    All queries run on `conn` when given, otherwise on one connection borrowed from the pool.
+    """
+    if conn is None:
+        async with get_pool().acquire() as conn:
+            return await auto_chunk_chat(chat_id, conn)
+
+    # Get all messages that haven't been chunked yet, already formatted for chunk text
+    messages, formatted_messages = await get_unchunked_messages(chat_id, conn)
 
-async def auto_chunk_chat(chat_id: int):
-    """Create new chunks for a chat from unchunked messages, using configured size and overlap."""
-    # Get all messages that haven't been chunked yet with all necessary relations
-    messages = await Message.filter(chat_id=chat_id)\
-        .annotate(num_chunks=Count("chunks"))\
-        .filter(num_chunks=0)\
-        .order_by("date")\
-        .prefetch_related(\
-            'from_user',\
-            'chat',\
-            'forward_from_user',\
-            'forward_from_chat',\
-            'reply_to_message',\
-            'reply_to_message__from_user',\
-            'media'\
-        )\
-        .all()
-    
     n = len(messages)
     if n == 0:
         return
-        
-    # Format messages for chunk text
-    formatted_messages = [format_message_for_display(m) for m in messages]
+
     windows = list(get_chunk_windows(n, CHUNK_SIZE, CHUNK_OVERLAP))
-    
-    for start, end in windows:
-        chunk_msgs = messages[start:end]
-        chunk_text = "\n".join(formatted_messages[start:end])
-        
-        # Create chunk with basic info
-        chunk = await ChunkEmbedding.create(
-            chat_id=chat_id,
-            chunk_text=chunk_text,
-            from_time=chunk_msgs[0].date.timestamp() if chunk_msgs else None,
-            to_time=chunk_msgs[-1].date.timestamp() if chunk_msgs else None
-        )
-        
-        # Add messages to chunk
-        if chunk_msgs:
-            await chunk.messages.add(*chunk_msgs)
-            
-            # Add users
-            users = {m.from_user for m in chunk_msgs if m.from_user}
-            if users:
-                await chunk.users.add(*users)
-                
-            # Add media
-            medias = [m.media for m in chunk_msgs if m.media]
-            if medias:
-                await chunk.medias.add(*medias)
-        
-        # Log the chunk creation
-        msg_ids = [m.id for m in chunk_msgs]
-        start_id = msg_ids[0] if msg_ids else 0
-        end_id = msg_ids[-1] if msg_ids else 0
-        logging.info(f"[CHUNK] New chunk created for chat {chat_id}: messages {start_id}-{end_id}, chunk_id={chunk.id}")
+    if not windows:
+        return
+
+    # Join once and slice each window out by offset instead of re-joining overlapping windows.
+    # offsets[i] is where formatted_messages[i] starts in `joined` (+1 per separating newline)
+    joined = "\n".join(formatted_messages)
+    offsets = [0]
+    for text in formatted_messages:
+        offsets.append(offsets[-1] + len(text) + 1)
+    chunk_windows = [
+        (messages[start:end], joined[offsets[start]:offsets[end] - 1])
+        for start, end in windows
+    ]
+    async with conn.transaction():
+        chunk_ids = await _create_chunks(conn, chat_id, chunk_windows)
+
+    # Log the chunk creation
+    for chunk_id, (chunk_msgs, _) in zip(chunk_ids, chunk_windows):
+        logger.info("[CHUNK] New chunk created for chat %s: messages %s-%s, chunk_id=%s", chat_id, chunk_msgs[0].id, chunk_msgs[-1].id, chunk_id)
 
 @log_function_call
 async def refresh_latest_chunk_for_chat(chat_id: int):
@@ -97,60 +226,39 @@ async def refresh_latest_chunk_for_chat(chat_id: int):
     Refresh (recreate) the latest chunk for a chat if enough new messages have arrived to slide the chunk window.
     Efficient sliding window: only fetch/process minimal set of messages.
     '''
-    from app.models.db_models import ChunkEmbedding, Message
-    from app.utils.message_formatting import format_message_for_display
-
-    # Get the latest chunk for this chat
-    latest_chunk = await ChunkEmbedding.filter(chat_id=chat_id).order_by('-to_time').prefetch_related('messages').first()
-    if latest_chunk:
-        # Get the last message in the latest chunk
-        last_msg = await latest_chunk.messages.order_by('-date').first()
-        if not last_msg:
+    async with get_pool().acquire() as conn:
+        # Fetch the last CHUNK_SIZE messages, only if a new chunk is due
+        rows = await conn.fetch(_REFRESH_WINDOW_SQL, chat_id, CHUNK_SIZE, max(0, CHUNK_SIZE - CHUNK_OVERLAP))
+        if not rows:
             return
-        # Count new messages after the last message in the chunk
-        new_messages_count = await Message.filter(chat_id=chat_id, date__gt=last_msg.date).count()
-        if new_messages_count >= (CHUNK_SIZE - CHUNK_OVERLAP):
-            # Fetch only the last CHUNK_SIZE messages for the new chunk
-            chunk_msgs = await Message.filter(chat_id=chat_id).order_by('-date').limit(CHUNK_SIZE).prefetch_related(
-                'from_user', 'chat', 'forward_from_user', 'forward_from_chat', 'reply_to_message', 'reply_to_message__from_user', 'media'
-            ).all()
-            chunk_msgs = list(reversed(chunk_msgs))
-            # Format and create new chunk
-            chunk_text = '\n'.join([format_message_for_display(m) for m in chunk_msgs])
-            from_time = chunk_msgs[0].date.timestamp() if chunk_msgs else None
-            to_time = chunk_msgs[-1].date.timestamp() if chunk_msgs else None
-            chunk = await ChunkEmbedding.create(
-                chat_id=chat_id,
-                chunk_text=chunk_text,
-                from_time=from_time,
-                to_time=to_time
-            )
-            await chunk.messages.add(*chunk_msgs)
-            users = [m.from_user for m in chunk_msgs if m.from_user]
-            if users:
-                await chunk.users.add(*users)
-            medias = [m.media for m in chunk_msgs if m.media]
-            if medias:
-                await chunk.medias.add(*medias)
-            msg_ids = [m.id for m in chunk_msgs]
-            start_id = msg_ids[0] if msg_ids else 0
-            end_id = msg_ids[-1] if msg_ids else 0
-            logger.info(f"[CHUNK] New chunk created for chat {chat_id}: messages {start_id}-{end_id}, chunk_id={chunk.id}")
+        chunk_msgs = [_message_from_row(r) for r in reversed(rows)]
 
-    else:
-        # No existing chunk, create the first one if enough messages
-        chunk_msgs = await Message.filter(chat_id=chat_id).order_by('-date').limit(CHUNK_SIZE).prefetch_related(
-            'from_user', 'chat', 'forward_from_user', 'forward_from_chat', 'reply_to_message', 'reply_to_message__from_user', 'media'
-        ).all()
-        chunk_msgs = list(reversed(chunk_msgs))
-        if len(chunk_msgs) == CHUNK_SIZE:
-            await create_or_update_chunk(chunk_msgs)
+        chunk_text = '\n'.join([format_message_for_display(m) for m in chunk_msgs])
+        async with conn.transaction():
+            chunk_id, = await _create_chunks(conn, chat_id, [(chunk_msgs, chunk_text)])
+        logger.info("[CHUNK] New chunk created for chat %s: messages %s-%s, chunk_id=%s", chat_id, chunk_msgs[0].id, chunk_msgs[-1].id, chunk_id)
 
-# For testing: create chunks for all chats
-def get_all_chat_ids():
-    return Message.all().distinct().values_list('chat_id', flat=True)
+async def get_all_chat_ids(conn: Optional[asyncpg.Connection] = None) -> List[int]:
+    """Return the ids of all chats that have messages (index-only scan on messages (chat_id, date))"""
+    if conn is None:
+        async with get_pool().acquire() as conn:
+            return await get_all_chat_ids(conn)
+    return [r['chat_id'] for r in await conn.fetch("SELECT DISTINCT chat_id FROM messages")]
 
+# For testing: create chunks for all chats
 async def auto_chunk_all_chats():
     chat_ids = await get_all_chat_ids()
-    for chat_id in chat_ids:
-        await auto_chunk_chat(chat_id)
+    # Chats are independent, so overlap their DB round-trips. Each chat holds a single
+    # connection for its whole run, and concurrency is capped at a quarter of the pool
+    # so message handlers never starve while a sweep is running.
+    semaphore = asyncio.Semaphore(max(1, get_pool().get_max_size() // 4))
+
+    async def _chunk_chat(chat_id: int):
+        async with semaphore:
+            await auto_chunk_chat(chat_id)
+
+    # One failing chat must not abort the sweep (and leave the other tasks running detached)
+    results = await asyncio.gather(*(_chunk_chat(chat_id) for chat_id in chat_ids), return_exceptions=True)
+    for chat_id, result in zip(chat_ids, results):
+        if isinstance(result, Exception):
+            logger.error("[CHUNK] Chunking chat %s failed: %s", chat_id, result, exc_info=result)
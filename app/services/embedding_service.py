@@ -2,13 +2,66 @@ import logging
 import numpy as np
 from typing import List, Optional, Dict, Any
 
+from openai import AsyncOpenAI, APIConnectionError, APITimeoutError, InternalServerError, RateLimitError
+
 from app.config import OPENAI_API_KEY, EMBEDDING_MODEL, EMBEDDING_DIM
+from app.db.pool import get_pool
 from app.models.db_models import ChunkEmbedding, Message, User, Media
+from app.utils.backoff import with_backoff
 
 logger = logging.getLogger(__name__)
 
-async def generate_embeddings(texts: List[str]) -> List[Optional[List[float]]]:
-    return [None] * len(texts)
+# Max number of inputs the embeddings endpoint accepts per request
+EMBEDDING_BATCH_SIZE = 2048
+EMBEDDING_MAX_ATTEMPTS = 6
+# Transient API failures (429s, timeouts, 5xx) worth retrying
+_RETRYABLE_ERRORS = (RateLimitError, APIConnectionError, APITimeoutError, InternalServerError)
+
+_client: Optional[AsyncOpenAI] = None
+
+def _get_client() -> AsyncOpenAI:
+    global _client
+    if _client is None:
+        # Retries are handled by with_backoff (jittered), not by the SDK
+        _client = AsyncOpenAI(api_key=OPENAI_API_KEY, max_retries=0)
+    return _client
+
+async def generate_embeddings(texts: List[str]) -> Optional[np.ndarray]:
+    """
+    Embed texts into an (len(texts), EMBEDDING_DIM) float32 array, one API request per
+    EMBEDDING_BATCH_SIZE inputs. Returns None when no OpenAI API key is configured.
+    """
+    if not OPENAI_API_KEY:
+        return None
+    embeddings = np.empty((len(texts), EMBEDDING_DIM), dtype=np.float32)
+    for i in range(0, len(texts), EMBEDDING_BATCH_SIZE):
+        batch = texts[i:i + EMBEDDING_BATCH_SIZE]
+        response = await with_backoff(
+            _get_client().embeddings.create,
+            input=batch,
+            model=EMBEDDING_MODEL,
+            max_attempts=EMBEDDING_MAX_ATTEMPTS,
+            retry_on=_RETRYABLE_ERRORS,
+        )
+        # Place each item by its index instead of relying on the response order
+        data = sorted(response.data, key=lambda d: d.index)
+        embeddings[i:i + len(batch)] = np.asarray([d.embedding for d in data], dtype=np.float32)
+    return embeddings
+
+# Ordered by the raw distance so the HNSW index on embedding_h can serve the query;
+# min_similarity is applied afterwards for the same reason.
+_SIMILAR_CHUNKS_SQL = """
+    SELECT c.id, c.chat_id, c.chunk_text, c.from_time, c.to_time,
+           1 - (c.embedding_h <=> $1::halfvec) AS similarity
+    FROM chunks c
+    WHERE c.embedding_h IS NOT NULL
+      AND ($2::bigint IS NULL OR c.chat_id = $2)
+      AND ($3::bigint IS NULL OR EXISTS (
+          SELECT 1 FROM chunks_users cu WHERE cu.chunks_id = c.id AND cu.user_id = $3
+      ))
+    ORDER BY c.embedding_h <=> $1::halfvec
+    LIMIT $4
+"""
 
 async def get_similar_chunks(
     query: str,
@@ -17,7 +70,42 @@ async def get_similar_chunks(
     limit: int = 5,
     min_similarity: float = 0.7
 ) -> List[Dict[str, Any]]:
-    return []
+    """Return chunks most similar to `query` (cosine), optionally limited to a chat and/or a participating user"""
+    embeddings = await generate_embeddings([query])
+    if embeddings is None:
+        return []
+    async with get_pool().acquire() as conn:
+        rows = await conn.fetch(_SIMILAR_CHUNKS_SQL, embeddings[0], chat_id, user_id, limit)
+    return [dict(r) for r in rows if r['similarity'] >= min_similarity]
 
 async def update_chunk_embeddings(chunk_ids: List[int]):
-    return
+    """(Re)compute embeddings for the given chunks and store both the FP32 and FP16 columns"""
+    if not chunk_ids:
+        return
+    async with get_pool().acquire() as conn:
+        rows = await conn.fetch(
+            "SELECT id, chunk_text FROM chunks WHERE id = ANY($1::int[]) ORDER BY id",
+            chunk_ids,
+        )
+    if not rows:
+        return
+    # Embed without holding a pooled connection: the API calls (and their retries) can take minutes
+    embeddings = await generate_embeddings([r['chunk_text'] or '' for r in rows])
+    if embeddings is None:
+        logger.warning("OPENAI_API_KEY is not set, skipping embeddings for %d chunks", len(rows))
+        return
+    # COPY the vectors (binary pgvector codecs) into a temp table, then update in one statement
+    async with get_pool().acquire() as conn:
+        async with conn.transaction():
+            await conn.execute(
+                "CREATE TEMP TABLE chunk_embeddings_in (id int, embedding vector, embedding_h halfvec) ON COMMIT DROP"
+            )
+            await conn.copy_records_to_table(
+                'chunk_embeddings_in',
+                records=[(r['id'], e, e) for r, e in zip(rows, embeddings)],
+                columns=('id', 'embedding', 'embedding_h'),
+            )
+            await conn.execute(
+                "UPDATE chunks c SET embedding = i.embedding, embedding_h = i.embedding_h "
+                "FROM chunk_embeddings_in i WHERE c.id = i.id"
+            )
@@ -3,9 +3,9 @@ from typing import Optional, Dict, Any
 from datetime import datetime, timezone
 
 from aiogram import types
-from tortoise.transactions import in_transaction
+from pydantic import TypeAdapter
 
-from app.models.db_models import User, Chat, Message, Media, ChunkEmbedding
+from app.db.pool import get_pool
 from app.services.chunking import refresh_latest_chunk_for_chat
 
 @log_function_call
@@ -13,174 +13,122 @@ async def process_message(message: types.Message) -> Optional[str]:
     """Process an incoming message and return a response if needed"""
     try:
         # Save the message to the database
-        saved_msg = await save_message(message)
+        await save_message(message)
         # Refresh chunk for this chat
-        await refresh_latest_chunk_for_chat(saved_msg.chat_id)
-        logger.info(f"Message {message.message_id} from {message.from_user.username} processed successfully")
+        await refresh_latest_chunk_for_chat(message.chat.id)
+        logger.info("Message %s from %s processed successfully", message.message_id, message.from_user.username)
         return None
     except Exception as e:
         log_exception(e)
-        logger.error(f"Error processing message {message.message_id}: {str(e)}")
+        logger.error("Error processing message %s: %s", message.message_id, e)
         return None
 
-async def save_message(message: types.Message) -> Message:
-    """Save a message to the database with full support for new DB structure."""
-    # Get or create user
-    user, _ = await User.get_or_create(
-        id=message.from_user.id,
-        defaults={
-            'first_name': message.from_user.first_name,
-            'last_name': message.from_user.last_name,
-            'username': message.from_user.username,
-            'language_code': getattr(message.from_user, 'language_code', None)
-        }
+# Reply/forward targets may be missing (e.g. sent before the bot joined), so the FK subselects
+# fall back to NULL, as get_or_none() did. ON CONFLICT keeps the first stored copy, like get_or_create().
+_UPSERT_REFS_SQL = """
+    WITH u AS (
+        INSERT INTO users (id, first_name, last_name, username, language_code)
+        VALUES ($1, $2, $3, $4, $5)
+        ON CONFLICT (id) DO NOTHING
+    ), c AS (
+        INSERT INTO chats (id, type, title, username)
+        VALUES ($6, $7, $8, $9)
+        ON CONFLICT (id) DO NOTHING
     )
+    INSERT INTO media (file_unique_id, media_type, file_id, caption, mime_type,
+                       file_size, width, height, duration, created_at)
+    SELECT $10::varchar, $11::varchar, $12::varchar, $13::text, $14::varchar,
+           $15::int, $16::int, $17::int, $18::int, now()
+    WHERE $10::varchar IS NOT NULL
+    ON CONFLICT (file_unique_id) DO NOTHING
+"""
 
-    # Get or create chat
-    chat, _ = await Chat.get_or_create(
-        id=message.chat.id,
-        defaults={
-            'type': message.chat.type,
-            'title': getattr(message.chat, 'title', None),
-            'username': getattr(message.chat, 'username', None)
-        }
-    )
+_INSERT_MESSAGE_SQL = """
+    INSERT INTO messages (id, from_user_id, chat_id, date, text, entities, media_id,
+                          reply_to_message_id, forward_from_user_id, forward_from_chat_id,
+                          forward_from_message_id, forward_sender_name)
+    VALUES ($1, $2, $3, $4, $5, $6, $7,
+            (SELECT id FROM messages WHERE id = $8),
+            (SELECT id FROM users WHERE id = $9),
+            (SELECT id FROM chats WHERE id = $10),
+            (SELECT id FROM messages WHERE id = $11),
+            $12)
+    ON CONFLICT (id) DO NOTHING
+    RETURNING id
+"""
 
-    # Prepare FK for reply and forward fields
-    reply_to_message = None
-    if message.reply_to_message:
-        reply_to_message = await Message.get_or_none(id=message.reply_to_message.message_id)
+_MEDIA_COLUMNS = ('file_unique_id', 'media_type', 'file_id', 'caption', 'mime_type', 'file_size', 'width', 'height', 'duration')
 
-    forward_from_user = None
-    if getattr(message, 'forward_from', None):
-        forward_from_user = await User.get_or_none(id=message.forward_from.id)
+# Dumps a whole entity list in one call instead of model_dump() per entity
+_ENTITIES_ADAPTER = TypeAdapter(list[types.MessageEntity])
 
-    forward_from_chat = None
-    if getattr(message, 'forward_from_chat', None):
-        forward_from_chat = await Chat.get_or_none(id=message.forward_from_chat.id)
+# Media types in priority order: (message attribute, extra attributes copied to the media row, store caption)
+_MEDIA_ATTRIBUTES = (
+    ('photo', ('file_size', 'width', 'height'), True),
+    ('animation', ('file_size', 'duration'), True),
+    ('audio', ('file_size', 'duration', 'mime_type'), True),
+    ('document', ('file_size', 'mime_type'), True),
+    ('video', ('file_size', 'width', 'height', 'duration'), True),
+    ('voice', ('file_size', 'duration'), False),
+    ('sticker', ('width', 'height'), False),
+)
 
-    forward_from_message = None
-    if getattr(message, 'forward_from_message_id', None):
-        forward_from_message = await Message.get_or_none(id=message.forward_from_message_id)
+def serialize_entities(entities):
+    if not entities:
+        return None
+    return _ENTITIES_ADAPTER.dump_python(entities, mode='json')
 
-    # Handle media
-    media_obj = None
-    media_type = None
-    media_content = None
+async def save_message(message: types.Message) -> bool:
+    """
+    Save a message, its sender, chat and media to the database in two statements and one transaction.
+    Returns False if the message was already stored.
+    """
+    from_user = message.from_user
+    chat = message.chat
 
-    # Telegram message can have only one media type at a time
-    if message.photo:
-        media_type = 'photo'
-        photo = message.photo[-1]
-        media_obj, _ = await Media.get_or_create(
-            file_unique_id=photo.file_unique_id,
-            defaults={
-                'media_type': 'photo',
-                'file_id': photo.file_id,
-                'file_size': photo.file_size,
-                'width': photo.width,
-                'height': photo.height,
-                'caption': message.caption,
-            }
-        )
-    elif message.animation:
-        media_type = 'animation'
-        media_obj, _ = await Media.get_or_create(
-            file_unique_id=message.animation.file_unique_id,
-            defaults={
-                'media_type': 'animation',
-                'file_id': message.animation.file_id,
-                'file_size': message.animation.file_size,
-                'duration': message.animation.duration,
-                'caption': message.caption,
-            }
-        )
-    elif message.audio:
-        media_type = 'audio'
-        media_obj, _ = await Media.get_or_create(
-            file_unique_id=message.audio.file_unique_id,
-            defaults={
-                'media_type': 'audio',
-                'file_id': message.audio.file_id,
-                'file_size': message.audio.file_size,
-                'duration': message.audio.duration,
-                'mime_type': getattr(message.audio, 'mime_type', None),
-                'caption': message.caption,
-            }
-        )
-    elif message.document:
-        media_type = 'document'
-        media_obj, _ = await Media.get_or_create(
-            file_unique_id=message.document.file_unique_id,
-            defaults={
-                'media_type': 'document',
-                'file_id': message.document.file_id,
-                'file_size': message.document.file_size,
-                'mime_type': getattr(message.document, 'mime_type', None),
-                'caption': message.caption,
-            }
-        )
-    elif message.video:
-        media_type = 'video'
-        media_obj, _ = await Media.get_or_create(
-            file_unique_id=message.video.file_unique_id,
-            defaults={
-                'media_type': 'video',
-                'file_id': message.video.file_id,
-                'file_size': message.video.file_size,
-                'width': message.video.width,
-                'height': message.video.height,
-                'duration': message.video.duration,
-                'caption': message.caption,
-            }
-        )
-    elif message.voice:
-        media_type = 'voice'
-        media_obj, _ = await Media.get_or_create(
-            file_unique_id=message.voice.file_unique_id,
-            defaults={
-                'media_type': 'voice',
-                'file_id': message.voice.file_id,
-                'file_size': message.voice.file_size,
-                'duration': message.voice.duration,
-            }
-        )
-    elif message.sticker:
-        media_type = 'sticker'
-        media_obj, _ = await Media.get_or_create(
-            file_unique_id=message.sticker.file_unique_id,
-            defaults={
-                'media_type': 'sticker',
-                'file_id': message.sticker.file_id,
-                'width': message.sticker.width,
-                'height': message.sticker.height,
-            }
-        )
-    # Prepare message data
-    # Serialize entities/caption_entities if present
-    def serialize_entities(entities):
-        if not entities:
-            return None
-        return [entity.model_dump() if hasattr(entity, 'model_dump') else entity.__dict__ for entity in entities]
+    # Handle media (Telegram message can have only one media type at a time)
+    media = {}
+    for media_type, attributes, with_caption in _MEDIA_ATTRIBUTES:
+        obj = getattr(message, media_type, None)
+        if obj:
+            if media_type == 'photo':
+                obj = obj[-1]  # Largest size
+            media = {attr: getattr(obj, attr, None) for attr in attributes}
+            media['file_unique_id'] = obj.file_unique_id
+            media['file_id'] = obj.file_id
+            media['media_type'] = media_type
+            if with_caption:
+                media['caption'] = message.caption
+            break
 
-    message_data = {
-        'id': message.message_id,
-        'from_user': user,
-        'chat': chat,
-        'date': message.date if hasattr(message, 'date') else datetime.now(timezone.utc),
-        'text': message.text or message.caption,
-        'entities': serialize_entities(message.entities or getattr(message, 'caption_entities', None)),
-        'media': media_obj,
-        'reply_to_message': reply_to_message,
-        'forward_from_user': forward_from_user,
-        'forward_from_chat': forward_from_chat,
-        'forward_from_message': forward_from_message,
-        'forward_sender_name': getattr(message, 'forward_sender_name', None),
-    }
+    forward_from = getattr(message, 'forward_from', None)
+    forward_from_chat = getattr(message, 'forward_from_chat', None)
 
-    # Save the message
-    message_obj, _ = await Message.get_or_create(id=message.message_id, defaults=message_data)
-    return message_obj
+    async with get_pool().acquire() as conn:
+        async with conn.transaction():
+            await conn.execute(
+                _UPSERT_REFS_SQL,
+                from_user.id, from_user.first_name, from_user.last_name, from_user.username,
+                getattr(from_user, 'language_code', None),
+                chat.id, chat.type, getattr(chat, 'title', None), getattr(chat, 'username', None),
+                *(media.get(column) for column in _MEDIA_COLUMNS),
+            )
+            message_id = await conn.fetchval(
+                _INSERT_MESSAGE_SQL,
+                message.message_id,
+                from_user.id,
+                chat.id,
+                message.date if hasattr(message, 'date') else datetime.now(timezone.utc),
+                message.text or message.caption,
+                serialize_entities(message.entities or getattr(message, 'caption_entities', None)),
+                media.get('file_unique_id'),
+                message.reply_to_message.message_id if message.reply_to_message else None,
+                forward_from.id if forward_from else None,
+                forward_from_chat.id if forward_from_chat else None,
+                getattr(message, 'forward_from_message_id', None),
+                getattr(message, 'forward_sender_name', None),
+            )
+    return message_id is not None
 
 async def create_chunks_for_chat(chat_id: int):
     """Create chunks for messages in a chat"""
@@ -0,0 +1,44 @@
+import asyncio
+import random
+import time
+from typing import Any, Awaitable, Callable, Optional, Tuple, Type
+
+from app.utils.logging_config import logger
+
+async def with_backoff(
+    coro_fn: Callable[..., Awaitable[Any]],
+    *args,
+    base: float = 1.0,
+    cap: float = 60.0,
+    max_attempts: Optional[int] = None,
+    retry_on: Tuple[Type[BaseException], ...] = (Exception,),
+    **kwargs,
+) -> Any:
+    """
+    Await coro_fn(*args, **kwargs), retrying on `retry_on` exceptions with jittered exponential backoff.
+    The n-th consecutive retry sleeps min(cap, base * 2**n) scaled by a random factor in [0.5, 1.5], so
+    clients failing together don't reconnect together. A call that ran longer than `cap` before failing
+    starts the backoff over, and an exception with a numeric `retry_after` (e.g. aiogram's
+    TelegramRetryAfter) sleeps exactly that long. Retries forever unless max_attempts is set, in which
+    case the last exception is re-raised after that many consecutive failures.
+    """
+    attempt = 0
+    while True:
+        started = time.monotonic()
+        try:
+            return await coro_fn(*args, **kwargs)
+        except retry_on as e:
+            if time.monotonic() - started > cap:
+                attempt = 0
+            attempt += 1
+            if max_attempts is not None and attempt >= max_attempts:
+                raise
+            retry_after = getattr(e, 'retry_after', None)
+            if isinstance(retry_after, (int, float)):
+                delay = float(retry_after)
+            else:
+                delay = min(cap, base * 2 ** (attempt - 1)) * random.uniform(0.5, 1.5)
+            logger.warning("%s failed (%r), retry %d in %.1fs", getattr(coro_fn, '__name__', coro_fn), e, attempt, delay)
+            await asyncio.sleep(delay)
+
+__all__ = ['with_backoff']
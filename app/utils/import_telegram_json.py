@@ -26,24 +26,32 @@ Expected JSON structure:
     ]
 }
 """
-import json
 import logging
 import asyncio
-from datetime import datetime
+from datetime import datetime, timezone
+from itertools import islice
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Set, Tuple
+from typing import Any, BinaryIO, Dict, Iterable, List, Optional, Set, Tuple
 
-from tortoise import Tortoise, transactions
+import ijson
+from tortoise import transactions
+from tortoise.backends.base.client import BaseDBAsyncClient
 from tqdm import tqdm
 from app.models.db_models import User, Message, Media, Chat
-from app.db import init_db
+from app.db import init_db, close_db
 from app.utils.logging_config import logger
 
 # Constants
 EXPORT_FILE = str(Path(__file__).parent / 'data' / 'result.json')  # Path to exported Telegram JSON
 BATCH_SIZE = 5000  # Number of messages to process in a single transaction
+INSERT_BATCH_SIZE = 1000  # Rows per INSERT in Message.bulk_create
+ID_LOOKUP_CHUNK_SIZE = 10000  # Max ids per IN (...) lookup, keeps statements small for large id sets
+_UTC = timezone.utc
 
 
+# Parsed from_id strings: an export has few distinct senders but every message repeats one
+_ID_CACHE: Dict[str, Optional[int]] = {}
+
 def extract_id(val: Any) -> Optional[int]:
     """
     Extract integer ID from Telegram 'user123', 'channel456', or plain int.
@@ -52,37 +60,51 @@ def extract_id(val: Any) -> Optional[int]:
     if isinstance(val, int):
         return val
     if isinstance(val, str):
-        val = val.strip()
-        if val.startswith('user'):
-            val = val[4:]
-        elif val.startswith('channel'):
-            val = val[7:]
         try:
-            return int(val)
-        except Exception:
-            return None
+            return _ID_CACHE[val]
+        except KeyError:
+            pass
+        raw = val.strip()
+        if raw.startswith('user'):
+            raw = raw[4:]
+        elif raw.startswith('channel'):
+            raw = raw[7:]
+        try:
+            result = int(raw)
+        except ValueError:
+            result = None
+        _ID_CACHE[val] = result
+        return result
     return None
 
 
-def update_progress_bar(pbar: tqdm, n: int, step: int = 1000) -> None:
-    """Update tqdm progress bar in steps of `step` messages."""
-    full_steps = n // step
-    remainder = n % step
-    for _ in range(full_steps):
-        pbar.update(step)
-    if remainder:
-        pbar.update(remainder)
+def update_progress_bar(pbar: tqdm, n: int) -> None:
+    """Advance the tqdm progress bar by `n` messages in one update."""
+    if n:
+        pbar.update(n)
 
 
-async def build_user_cache(messages: List[Dict[str, Any]]) -> Dict[int, User]:
-    """Build a user cache from all unique user IDs in messages, preloading from DB."""
-    user_ids = {extract_id(msg.get('from_id')) for msg in messages if extract_id(msg.get('from_id')) is not None}
-    user_cache = {}
-    if user_ids:
-        users = await User.filter(id__in=user_ids)
-        for user in users:
-            user_cache[user.id] = user
-    return user_cache
+def read_chat_header(f: BinaryIO) -> Dict[str, Any]:
+    """
+    Read the top-level chat fields (id, name, type) of an export without building the messages list.
+    Telegram writes them before "messages", so parsing stops there at the latest, even if a field
+    is null or missing.
+    """
+    header = {}
+    for prefix, event, value in ijson.parse(f):
+        if prefix == 'messages' and event == 'start_array':
+            break
+        if prefix in ('id', 'name', 'type') and event in ('string', 'number'):
+            header[prefix] = value
+            if len(header) == 3:
+                break
+    return header
+
+def iter_batches(items: Iterable[Any], size: int) -> Iterable[List[Any]]:
+    """Yield lists of up to `size` items from an iterator"""
+    items = iter(items)
+    while batch := list(islice(items, size)):
+        yield batch
 
 def process_text_and_entities(text_entities: List[Dict[str, Any]]) -> Tuple[str, Optional[List[Dict[str, Any]]]]:
     """
@@ -102,7 +124,7 @@ def process_text_and_entities(text_entities: List[Dict[str, Any]]) -> Tuple[str,
     
     for segment in text_entities:
         if not isinstance(segment, dict):
-            logger.warning(f"Skipping invalid text segment: {segment}")
+            logger.warning("Skipping invalid text segment: %s", segment)
             continue
             
         segment_text = segment.get('text', '')
@@ -124,19 +146,35 @@ def process_text_and_entities(text_entities: List[Dict[str, Any]]) -> Tuple[str,
     
     return text, (entities if has_rich_entities else None)
 
-async def process_message(msg: Dict[str, Any], chat_obj: Chat, user_cache: Dict[int, User], db_counters: Dict[str, int]) -> Optional[Message]:
+def parse_message_date(msg: Dict[str, Any]) -> datetime:
+    """Aware UTC datetime of an exported message, like the bot stores for live messages"""
+    try:
+        return datetime.fromtimestamp(int(msg['date_unixtime']), _UTC)
+    except (KeyError, ValueError, TypeError) as e:
+        try:
+            # Older exports only have the ISO "date" field (no offset, taken as UTC)
+            message_date = datetime.fromisoformat(msg['date'])
+        except (KeyError, ValueError, TypeError):
+            logger.warning("Invalid date for message %s: %s", msg.get('id'), e)
+            return datetime.now(_UTC)
+        if message_date.tzinfo is None:
+            message_date = message_date.replace(tzinfo=_UTC)
+        return message_date
+
+def process_message(msg: Dict[str, Any], chat_obj: Chat, user_cache: Dict[int, User]) -> Optional[Message]:
     """
     Process a single message from Telegram export and return a Message instance if valid.
     
     Args:
         msg: Raw message data from Telegram export.
         chat_obj: The Chat instance this message belongs to.
+        user_cache: Senders by id, already filled for this batch by preload_batch_users().
         
     Returns:
         Message instance if message is valid and should be imported, None otherwise.
     """
     if msg.get('type') != 'message':
-        logger.debug(f"Skipping non-message type: {msg.get('type')}")
+        logger.debug("Skipping non-message type: %s", msg.get('type'))
         return None
         
     msg_id = msg.get('id')
@@ -144,7 +182,7 @@ async def process_message(msg: Dict[str, Any], chat_obj: Chat, user_cache: Dict[
         logger.warning("Message missing ID, skipping")
         return None
         
-    logger.debug(f"Processing message ID: {msg_id}")
+    logger.debug("Processing message ID: %s", msg_id)
 
     # Process user
     from_user_obj = None
@@ -154,20 +192,13 @@ async def process_message(msg: Dict[str, Any], chat_obj: Chat, user_cache: Dict[
     from_id_val = msg.get('from_id')
     user_id = extract_id(from_id_val)
     if user_id is not None:
-        if user_id in user_cache:
-            from_user_obj = user_cache[user_id]
-        else:
-            from_user_obj = await User.get_or_none(id=user_id)
-            if not from_user_obj:
-                from_user_obj = await User.create(id=user_id)
-            user_cache[user_id] = from_user_obj
-            db_counters['user'] += 1
+        from_user_obj = user_cache.get(user_id)
     # Optionally handle forward_sender_name for channels
     if from_id_val and isinstance(from_id_val, str) and from_id_val.startswith('channel'):
         forward_sender_name = msg.get('from')
 
     if not from_user_obj:
-        logger.warning(f"Message {msg_id} has no valid user, skipping")
+        logger.warning("Message %s has no valid user, skipping", msg_id)
         return None
 
     # Process text and entities
@@ -192,18 +223,12 @@ async def process_message(msg: Dict[str, Any], chat_obj: Chat, user_cache: Dict[
         forward_sender_name = forward_from
         text = f"(forwarded from {forward_sender_name}): {text}"
 
-    try:
-        message_date = datetime.fromtimestamp(int(msg['date_unixtime']))
-    except (KeyError, ValueError, TypeError) as e:
-        logger.warning(f"Invalid date for message {msg_id}: {e}")
-        message_date = datetime.now()
-    
     return Message(
         id=msg_id,
         chat=chat_obj,
         from_user=from_user_obj,
         text=text,
-        date=message_date,
+        date=parse_message_date(msg),
         entities=entities,
         reply_to_message_id=msg.get('reply_to_message_id'),
         forward_sender_name=forward_sender_name or msg.get('forward_sender_name')
@@ -215,7 +240,7 @@ async def get_existing_message_ids(chat_obj: Chat, message_ids: List[int]) -> Se
     
     Args:
         chat_obj: Chat instance to check messages in.
-        message_ids: List of message IDs to check.
+        message_ids: Message IDs to check (looked up ID_LOOKUP_CHUNK_SIZE at a time).
         
     Returns:
         Set of message IDs that already exist in the database.
@@ -224,24 +249,45 @@ async def get_existing_message_ids(chat_obj: Chat, message_ids: List[int]) -> Se
         return set()
         
     try:
-        existing = await Message.filter(chat=chat_obj).values_list('id', flat=True)
-        return set(existing)
+        existing = set()
+        for ids in iter_batches(message_ids, ID_LOOKUP_CHUNK_SIZE):
+            existing.update(await Message.filter(chat=chat_obj, id__in=ids).values_list('id', flat=True))
+        return existing
     except Exception as e:
-        logger.error(f"Error fetching existing message IDs: {e}")
+        logger.error("Error fetching existing message IDs: %s", e)
         return set()
 
-async def process_messages_batch(messages_batch: List[Dict[str, Any]], chat_obj: Chat, user_cache, db_counters) -> List[Message]:
-    """Process a batch of messages in parallel with user cache."""
-    async def process_single(msg):
+async def preload_batch_users(messages_batch: List[Dict[str, Any]], user_cache: Dict[int, User], db_counters: Dict[str, int], using_db: Optional[BaseDBAsyncClient] = None) -> None:
+    """
+    Put every sender of the batch into user_cache up front, so process_message() only does dict lookups
+    and concurrent messages from the same new user can't race to create it.
+    """
+    missing_ids = {extract_id(msg.get('from_id')) for msg in messages_batch} - user_cache.keys() - {None}
+    if not missing_ids:
+        return
+    # Insert the senders we haven't seen yet (existing ones are skipped), then load them all:
+    # Tortoise won't use bulk-created instances as FK targets (they aren't marked saved)
+    await User.bulk_create([User(id=user_id) for user_id in missing_ids], ignore_conflicts=True, using_db=using_db)
+    user_cache.update({user.id: user for user in await User.filter(id__in=missing_ids).using_db(using_db)})
+    db_counters['user'] += 2
+
+async def process_messages_batch(messages_batch: List[Dict[str, Any]], chat_obj: Chat, user_cache, db_counters, using_db: Optional[BaseDBAsyncClient] = None) -> List[Message]:
+    """Process a batch of messages with user cache (senders are preloaded, so this is pure CPU work)."""
+    await preload_batch_users(messages_batch, user_cache, db_counters, using_db)
+
+    processed = []
+    seen_ids = set()
+    for msg in messages_batch:
         try:
-            result = await process_message(msg, chat_obj, user_cache, db_counters)
-            return result
+            message_obj = process_message(msg, chat_obj, user_cache)
         except Exception as e:
-            logger.error(f"Error processing message {msg.get('id')}: {e}")
-            return None
-    tasks = [process_single(msg) for msg in messages_batch]
-    results = await asyncio.gather(*tasks, return_exceptions=True)
-    return [r for r in results if r is not None and not isinstance(r, Exception)]
+            logger.error("Error processing message %s: %s", msg.get('id'), e)
+            continue
+        # Exports can repeat a message id; keep the first copy, like the database would
+        if message_obj is not None and message_obj.id not in seen_ids:
+            seen_ids.add(message_obj.id)
+            processed.append(message_obj)
+    return processed
 
 
 async def import_telegram_json(export_file: str = EXPORT_FILE) -> None:
@@ -260,79 +306,65 @@ async def import_telegram_json(export_file: str = EXPORT_FILE) -> None:
         if not export_path.exists():
             raise FileNotFoundError(f"Export file not found: {export_file}")
             
-        logger.info(f"Loading Telegram export from {export_file}")
-        with export_path.open('r', encoding='utf-8') as f:
-            data = json.load(f)
-        
-        # Validate required fields
-        chat_id = data.get('id')
-        if chat_id and str(chat_id).isdigit() and int(chat_id) > 0:
-            chat_id = int(f"-100{chat_id}")
-        chat_title = data.get('name', 'Unknown')
-        chat_type = data.get('type', 'private')
-        messages = data.get('messages', [])
-
-        imported_count = 0
-
-        # --- Preload user and chat caches ---
-        user_cache = await build_user_cache(messages)
-
-        if not messages:
-            logger.warning("No messages found in export file")
-            return
-
-        # Create or get chat
-        try:
-            async with transactions.in_transaction():
-                chat_obj, created = await Chat.get_or_create(
-                    id=chat_id,
-                    defaults={'title': chat_title, 'type': chat_type}
-                )
-                if created:
-                    logger.info(f"Created new chat: {chat_title} ({chat_type})")
-                else:
-                    logger.info(f"Found existing chat: {chat_title}")
-        except Exception as e:
-            logger.error(f"Error creating/updating chat: {e}")
-            return
-
-        # Filter and process messages
-        messages = [msg for msg in messages if msg.get('type') == 'message']
-        if not messages:
-            logger.warning("No valid messages to import")
-            return
-
-        # Process messages in batches
-        # Get all existing message IDs in one query
-        all_message_ids = {msg['id'] for msg in messages if 'id' in msg}
-        existing_ids = await get_existing_message_ids(chat_obj, all_message_ids)
-
-        # Filter out existing messages
-        new_messages = [msg for msg in messages if msg.get('id') not in existing_ids]
-        logger.info(f"Found {len(existing_ids)} existing messages, {len(new_messages)} new messages to import")
-
-        # Process only new messages in batches
-        db_counters = {'user': 0, 'chat': 0, 'message': 0}
-        with tqdm(total=len(new_messages), desc="Importing messages", unit="msg") as pbar:
-            for i in range(0, len(new_messages), BATCH_SIZE):
-                batch_messages = new_messages[i:i + BATCH_SIZE]
-                
-                # Process batch in parallel with progress updates
-                processed_batch = await process_messages_batch(batch_messages, chat_obj, user_cache, db_counters)
-
-                # Update progress every 1000 messages
-                update_progress_bar(pbar, len(batch_messages), step=1000)
-
-                # Save batch
-                if processed_batch:
+        logger.info("Loading Telegram export from %s", export_file)
+        # Stream the export: memory stays O(BATCH_SIZE) instead of O(file size)
+        with export_path.open('rb') as f:
+            header = read_chat_header(f)
+
+            # Validate required fields
+            chat_id = header.get('id')
+            if chat_id and str(chat_id).isdigit() and int(chat_id) > 0:
+                chat_id = int(f"-100{chat_id}")
+            chat_title = header.get('name', 'Unknown')
+            chat_type = header.get('type', 'private')
+
+            imported_count = 0
+            user_cache: Dict[int, User] = {}
+
+            # Create or get chat
+            try:
+                async with transactions.in_transaction():
+                    chat_obj, created = await Chat.get_or_create(
+                        id=chat_id,
+                        defaults={'title': chat_title, 'type': chat_type}
+                    )
+                    if created:
+                        logger.info("Created new chat: %s (%s)", chat_title, chat_type)
+                    else:
+                        logger.info("Found existing chat: %s", chat_title)
+            except Exception as e:
+                logger.error("Error creating/updating chat: %s", e)
+                return
+
+            # Filter and process messages in batches
+            f.seek(0)
+            messages = (msg for msg in ijson.items(f, 'messages.item', use_float=True) if msg.get('type') == 'message')
+
+            db_counters = {'user': 0, 'chat': 0, 'message': 0}
+            existing_count = 0
+            with tqdm(desc="Importing messages", unit="msg", mininterval=0.5) as pbar:
+                for batch in iter_batches(messages, BATCH_SIZE):
+                    # Skip messages that are already in the database
+                    existing_ids = await get_existing_message_ids(chat_obj, [msg['id'] for msg in batch if 'id' in msg])
+                    existing_count += len(existing_ids)
+                    batch_messages = [msg for msg in batch if msg.get('id') not in existing_ids]
+
+                    # Create the batch's new users and save its messages in one transaction
                     try:
-                        async with transactions.in_transaction():
-                            await Message.bulk_create(processed_batch)
+                        async with transactions.in_transaction() as conn:
+                            processed_batch = await process_messages_batch(batch_messages, chat_obj, user_cache, db_counters, using_db=conn)
+                            if processed_batch:
+                                # Messages stored concurrently since the existence check are skipped, not fatal
+                                await Message.bulk_create(processed_batch, batch_size=INSERT_BATCH_SIZE, ignore_conflicts=True, using_db=conn)
+                                db_counters['message'] += 1  # One bulk write per batch
                         imported_count += len(processed_batch)
-                        db_counters['message'] += 1  # One bulk write per batch
                     except Exception as e:
-                        logger.error(f"Error saving batch: {e}")
-                        # Fall back to individual saves
+                        logger.error("Error saving batch: %s", e)
+                        # The rollback also undid this batch's new users: drop the batch's senders
+                        # from the cache, redo them outside the transaction and save messages one by one
+                        for msg in batch_messages:
+                            user_cache.pop(extract_id(msg.get('from_id')), None)
+                        processed_batch = await process_messages_batch(batch_messages, chat_obj, user_cache, db_counters)
                         for msg_obj in processed_batch:
                             try:
                                 await msg_obj.save()
@@ -340,17 +372,22 @@ async def import_telegram_json(export_file: str = EXPORT_FILE) -> None:
                                 db_counters['message'] += 1  # One write per message
                             except Exception:
                                 pass
+
+                    # Update progress once per batch
+                    update_progress_bar(pbar, len(batch))
+
+        if not imported_count and not existing_count:
+            logger.warning("No valid messages to import")
+        logger.info("Found %d existing messages, %d new messages imported", existing_count, imported_count)
+        logger.info("Successfully imported %d messages to chat %s (id=%s)", imported_count, chat_title, chat_id)
+        logger.info("DB usage: User lookups: %d, Chat lookups: %d, Message writes: %d", db_counters['user'], db_counters['chat'], db_counters['message'])
         
-        logger.info(f"Successfully imported {imported_count} messages to chat {chat_title} (id={chat_id})")
-        logger.info(f"DB usage: User lookups: {db_counters['user']}, Chat lookups: {db_counters['chat']}, Message writes: {db_counters['message']}")
-        
-    except json.JSONDecodeError:
-        logger.error(f"Invalid JSON in export file: {export_file}")
+    except ijson.JSONError:
+        logger.error("Invalid JSON in export file: %s", export_file)
     except Exception as e:
-        logger.error(f"Error during import: {e}", exc_info=True)
+        logger.error("Error during import: %s", e, exc_info=True)
     finally:
-        await Tortoise.close_connections()
+        await close_db()
 
 if __name__ == "__main__":
-    import asyncio
     asyncio.run(import_telegram_json())
\ No newline at end of file
@@ -4,7 +4,6 @@ import os
 from logging.handlers import RotatingFileHandler
 from functools import wraps
 import traceback
-import inspect
 
 import os
 LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
@@ -19,6 +18,10 @@ LOG_FORMAT = '[%(asctime)s] [%(levelname)s] [%(name)s] %(message)s'
 DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
 
 import logging
+# Records never use %(thread)/%(process) fields, so skip looking them up for each one
+logging.logThreads = False
+logging.logProcesses = False
+
 logger = logging.getLogger('memoria_bot')
 logger.setLevel(getattr(logging, LOG_LEVEL, logging.INFO))
 
@@ -72,13 +75,13 @@ logger.propagate = True  # Ensure logs go to root logger only
 
 # Patch logger.error to always include traceback and function name
 def error_with_traceback(msg, *args, **kwargs):
-    tb = traceback.format_exc()
-    stack = inspect.stack()
-    func_name = stack[1].function
-    if tb.strip() == 'NoneType: None':
+    func_name = sys._getframe(1).f_code.co_name
+    # Only format a traceback while an exception is being handled, and not when
+    # exc_info= already makes logging print it
+    if sys.exc_info()[0] is None or kwargs.get('exc_info'):
         logger._old_error(f"[{func_name}] {msg}", *args, **kwargs)
     else:
-        logger._old_error(f"[{func_name}] {msg}\nTraceback:\n{tb}", *args, **kwargs)
+        logger._old_error(f"[{func_name}] {msg}\nTraceback:\n{traceback.format_exc()}", *args, **kwargs)
 
 if not hasattr(logger, '_old_error'):
     logger._old_error = logger.error
@@ -87,8 +90,7 @@ if not hasattr(logger, '_old_error'):
 def log_exception(exc: Exception, msg: str = None):
     """Log an exception with traceback."""
     tb = traceback.format_exc()
-    stack = inspect.stack()
-    func_name = stack[1].function
+    func_name = sys._getframe(1).f_code.co_name
     logger._old_error(f"[{func_name}] {msg or 'Exception occurred'}: {exc}\nTraceback:\n{tb}")
 
 def _short_repr(val):
@@ -106,11 +108,15 @@ def _short_repr(val):
         return repr(val)
 
 def log_function_call(func):
+    # Tracing is only useful at DEBUG level; otherwise leave hot paths undecorated
+    if not logger.isEnabledFor(logging.DEBUG):
+        return func
+
     @wraps(func)
     def wrapper(*args, **kwargs):
         arg_preview = ', '.join(_short_repr(a) for a in args)
         kwarg_preview = ', '.join(f"{k}={_short_repr(v)}" for k, v in kwargs.items())
-        logger.debug(f"Called {func.__name__} with args=[{arg_preview}], kwargs=[{kwarg_preview}]")
+        logger.debug("Called %s with args=[%s], kwargs=[%s]", func.__name__, arg_preview, kwarg_preview)
         try:
             return func(*args, **kwargs)
         except Exception as exc:
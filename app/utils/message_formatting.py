@@ -1,9 +1,23 @@
 from datetime import datetime
+from functools import lru_cache
 from typing import Optional
 
+import orjson
+
 def format_username(user) -> str:
     """Return username if available, else full_name (no links, plain text)."""
-    return user.username if getattr(user, 'username', None) else user.full_name if getattr(user, 'full_name', None) else user.id
+    return _display_name(_user_fields(user))
+
+# (prefix, suffix) Markdown markers per entity type; text_link is handled separately (needs the url)
+_WRAP: dict[str, tuple[str, str]] = {
+    'bold': ("**", "**"),
+    'italic': ("*", "*"),
+    'underline': ("__", "__"),
+    'strikethrough': ("~~", "~~"),
+    'blockquote': ("> ", ""),
+    'pre': ("`", "`"),
+    'spoiler': ("||", "||"),
+}
 
 def format_entities(text: str, entities: Optional[list]) -> str:
     """
@@ -12,72 +26,105 @@ def format_entities(text: str, entities: Optional[list]) -> str:
     """
     if not entities:
         return text
-    # Sort entities by offset (descending) so that inserting tags doesn't shift text for later entities
-    entities = sorted(entities, key=lambda e: e['offset'], reverse=True)
-    for ent in entities:
-        offset = ent['offset']
-        length = ent['length']
+    # Collect every marker with its position in the original text, then copy text and markers
+    # out in a single left-to-right pass. Outer entities (earlier, longer) open first and close
+    # last, so nested entities stay properly nested.
+    inserts = []
+    ordered = sorted(entities, key=lambda e: (e['offset'], -e['length']))
+    for rank, ent in enumerate(ordered):
         etype = ent['type']
-        segment = text[offset:offset+length]
-        if etype == 'bold':
-            segment = f"**{segment}**"
-        elif etype == 'italic':
-            segment = f"*{segment}*"
-        elif etype == 'underline':
-            segment = f"__{segment}__"
-        elif etype == 'strikethrough':
-            segment = f"~~{segment}~~"
-        elif etype == 'blockquote':
-            segment = f"> {segment}"
-        elif etype == 'pre':
-            segment = f"`{segment}`"
-        elif etype == 'spoiler':
-            segment = f"||{segment}||"
-        elif etype == 'text_link' and ent.get('url'):
-            segment = f"[{segment}]({ent['url']})"
-        # Replace in text
-        text = text[:offset] + segment + text[offset+length:]
-    return text
+        if etype == 'text_link' and (url := ent.get('url')):
+            markers = ("[", f"]({url})")
+        else:
+            markers = _WRAP.get(etype)
+            if not markers:
+                continue
+        offset = ent['offset']
+        end = offset + ent['length']
+        # At a shared position closing markers go before opening ones (except for empty entities)
+        inserts.append((offset, 1, rank, markers[0]))
+        inserts.append((end, 0 if end > offset else 2, -rank, markers[1]))
+    inserts.sort()
+
+    parts = []
+    pos = 0
+    for at, _, _, marker in inserts:
+        if at > pos:
+            parts.append(text[pos:at])
+            pos = at
+        parts.append(marker)
+    parts.append(text[pos:])
+    return ''.join(parts)
 
 from app.utils.logging_config import logger, log_exception, log_function_call
 
-@log_function_call
-def format_message_for_display(message) -> str:
-    """
-    Formats a DB Message object into a readable string for display/chunking.
-    Supports: date, user, forward (from user/chat), reply, entities, media.
-    Optimized for clarity and efficiency.
-    """
-    dt = message.date.strftime("%d.%m.%Y %H:%M")
-    from_user = getattr(message, 'from_user', None)
-    user_str = format_username(from_user) if from_user else "Unknown"
+# Formatted strings are memoized per message: chunk windows overlap and the latest
+# window is re-rendered on every refresh, so the same rows are formatted repeatedly.
+FORMAT_CACHE_SIZE = 100_000
+
+def _user_fields(user) -> Optional[tuple]:
+    """Hashable snapshot of the user attributes a display name is built from."""
+    if not user:
+        return None
+    return (getattr(user, 'id', None), getattr(user, 'username', None), getattr(user, 'full_name', None))
+
+def _display_name(user_fields: tuple) -> str:
+    """Username if available, else full_name, else id, for a _user_fields() snapshot."""
+    user_id, username, full_name = user_fields
+    return username if username else full_name if full_name else user_id
+
+@lru_cache(maxsize=FORMAT_CACHE_SIZE)
+def _format_cached(message_id, date, from_user, forward_user, forward_chat, forward_sender_name, reply, text, entities_json, media_type) -> str:
+    """Build the display string from hashable message fields (see format_message_for_display)."""
+    dt = date.strftime("%d.%m.%Y %H:%M")
+    user_str = _display_name(from_user) if from_user else "Unknown"
 
     # Forwarded
-    forward_user = getattr(message, 'forward_from_user', None)
-    forward_chat = getattr(message, 'forward_from_chat', None)
-    forward_sender_name = getattr(message, 'forward_sender_name', None)
     forward_str = ""
-    if forward_user and (not (hasattr(forward_user, 'id') and hasattr(from_user, 'id') and forward_user.id == from_user.id)):
-        forward_str = f" (forwarded from {format_username(forward_user)})"
+    if forward_user and not (from_user and forward_user[0] == from_user[0]):
+        forward_str = f" (forwarded from {_display_name(forward_user)})"
     elif forward_chat:
-        forward_str = f" (forwarded from chat: {getattr(forward_chat, 'title', forward_chat.id)})"
+        forward_str = f" (forwarded from chat: {forward_chat[1]})"
     elif forward_sender_name:
         forward_str = f" (forwarded from {forward_sender_name})"
 
     # Reply
-    reply_msg = getattr(message, 'reply_to_message', None)
     reply_str = ""
-    if reply_msg:
-        reply_user = getattr(reply_msg, 'from_user', None)
-        reply_str = f" (reply to {format_username(reply_user)})" if reply_user else " (reply)"
+    if reply:
+        reply_user = reply[0]
+        reply_str = f" (reply to {_display_name(reply_user)})" if reply_user else " (reply)"
 
     # Entities
-    text = format_entities(getattr(message, 'text', '') or '', getattr(message, 'entities', None))
+    text = format_entities(text, orjson.loads(entities_json) if entities_json else None)
 
     # Media
-    media = getattr(message, 'media', None)
-    media_str = f" ({media.media_type})" if media and getattr(media, 'media_type', None) else ""
+    media_str = f" ({media_type})" if media_type else ""
 
     return f"{dt} {user_str}{forward_str}{reply_str}:{media_str} {text}"
 
+@log_function_call
+def format_message_for_display(message) -> str:
+    """
+    Formats a DB Message object into a readable string for display/chunking.
+    Supports: date, user, forward (from user/chat), reply, entities, media.
+    Results are memoized on the message id plus every field that ends up in the output.
+    """
+    forward_chat = getattr(message, 'forward_from_chat', None)
+    reply_msg = getattr(message, 'reply_to_message', None)
+    entities = getattr(message, 'entities', None)
+    media = getattr(message, 'media', None)
+    return _format_cached(
+        getattr(message, 'id', None),
+        message.date,
+        _user_fields(getattr(message, 'from_user', None)),
+        _user_fields(getattr(message, 'forward_from_user', None)),
+        (forward_chat.id, getattr(forward_chat, 'title', forward_chat.id)) if forward_chat else None,
+        getattr(message, 'forward_sender_name', None),
+        (_user_fields(getattr(reply_msg, 'from_user', None)),) if reply_msg else None,
+        getattr(message, 'text', '') or '',
+        # Serialized entities make a cheap hashable key (and cover edits: any change is a new key)
+        orjson.dumps(entities) if entities else None,
+        getattr(media, 'media_type', None) if media else None,
+    )
+
 # (Optional) aiogram support can be added here if needed in the future.
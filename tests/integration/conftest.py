@@ -0,0 +1,9 @@
+# Run the integration tests on uvloop, like the bot itself, when it is installed
+try:
+    import uvloop
+except ImportError:  # Not available on Windows
+    uvloop = None
+
+if uvloop is not None:
+    def pytest_asyncio_loop_factories(config, item):
+        return {"uvloop": uvloop.new_event_loop}
@@ -1,7 +1,23 @@
 import asyncio
+import hashlib
 import logging
+import os
+from typing import Optional
+from urllib.parse import urlsplit, urlunsplit
+
+import asyncpg
+import pytest
+import pytest_asyncio
 from tortoise import Tortoise
-from app.db import init_db, close_db
+from tortoise.backends.asyncpg.schema_generator import AsyncpgSchemaGenerator
+from tortoise.exceptions import OperationalError
+from tortoise.utils import get_schema_sql
+
+try:
+    import app.db
+    from app.db import init_db, close_db, _vector_installed, SETUP_SQL
+except ValueError as e:  # app.config refuses to load without TELEGRAM_BOT_TOKEN
+    pytest.skip(f"Database settings not configured: {e}", allow_module_level=True)
 
 # Configure logging
 logging.basicConfig(
@@ -10,38 +26,137 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-async def test_connection():
+# Seconds to wait for the database before failing instead of hanging the run
+DB_TIMEOUT = float(os.getenv("DB_INIT_TIMEOUT", "5"))
+
+# Where a local Postgres server puts its Unix socket
+POSTGRES_SOCKET_DIR = os.getenv("POSTGRES_SOCKET_DIR", "/var/run/postgresql")
+
+def unix_socket_url(url: str) -> str:
+    """Rewrite a localhost DSN to use the server's Unix socket (no TCP stack) when the socket exists"""
+    parts = urlsplit(url)
+    if parts.scheme not in ("postgres", "postgresql") or parts.hostname not in ("localhost", "127.0.0.1") or parts.query:
+        return url
+    port = parts.port or 5432
+    if not os.path.exists(os.path.join(POSTGRES_SOCKET_DIR, f".s.PGSQL.{port}")):
+        return url
+    userinfo = parts.netloc.rpartition("@")[0]
+    netloc = f"{userinfo}@" if userinfo else ""
+    return urlunsplit((parts.scheme, netloc, parts.path, f"host={POSTGRES_SOCKET_DIR}&port={port}", ""))
+
+# Set POSTGRES_TEMPLATE_DB to run against a fresh "<template>_test" copy of a prebuilt database:
+# CREATE DATABASE ... TEMPLATE copies its files instead of replaying the DDL. The template is built
+# with init_db() on first use; drop it to rebuild after model changes.
+TEMPLATE_DB = os.getenv("POSTGRES_TEMPLATE_DB")
+
+def with_database(url: str, database: str) -> str:
+    return urlunsplit(urlsplit(url)._replace(path=f"/{database}"))
+
+async def clone_template_db(url: str) -> str:
+    """Recreate the test database from TEMPLATE_DB (building the template if missing) and return its URL"""
+    test_db = f"{TEMPLATE_DB}_test"
+    conn = await asyncpg.connect(url)
     try:
-        # Initialize the database connection
-        await init_db()
-        logger.info("Successfully connected to the database")
-        
-        # Test creating a simple table
-        await Tortoise.generate_schemas()
-        logger.info("Successfully generated database schema")
-        
-        # Test vector extension
-        conn = Tortoise.get_connection("default")
-        result = await conn.execute_query(
-            "SELECT name, default_version, installed_version FROM pg_available_extensions WHERE name = 'vector'"
-        )
-        logger.info(f"pgvector extension info: {result}")
-        
-        return True
-    except Exception as e:
-        logger.error(f"Database connection test failed: {e}")
-        return False
+        if not await conn.fetchval("SELECT 1 FROM pg_database WHERE datname = $1", TEMPLATE_DB):
+            logger.info("Building template database %s", TEMPLATE_DB)
+            await conn.execute(f'CREATE DATABASE "{TEMPLATE_DB}"')
+            app.db.DATABASE_URL = with_database(url, TEMPLATE_DB)
+            await init_db()
+            await close_db()  # A template can't be copied while anyone is connected to it
+        await conn.execute(f'DROP DATABASE IF EXISTS "{test_db}"')
+        await conn.execute(f'CREATE DATABASE "{test_db}" TEMPLATE "{TEMPLATE_DB}"')
     finally:
-        await close_db()
+        await conn.close()
+    return with_database(url, test_db)
 
-if __name__ == "__main__":
+# Hash of the last schema SQL applied by this test; lets reruns skip unchanged DDL
+SCHEMA_VERSION_SQL = """
+CREATE TABLE IF NOT EXISTS schema_version (id INT PRIMARY KEY DEFAULT 1 CHECK (id = 1), hash TEXT NOT NULL);
+INSERT INTO schema_version (hash) VALUES ('{hash}') ON CONFLICT (id) DO UPDATE SET hash = EXCLUDED.hash;
+"""
+
+# Set PYTEST_FAST_SCHEMA=1 to create the tables without foreign keys (much cheaper DDL;
+# nothing in the integration tests relies on the constraints). Tables that already exist keep theirs.
+FAST_SCHEMA = bool(os.environ.get("PYTEST_FAST_SCHEMA"))
+
+class NoForeignKeySchemaGenerator(AsyncpgSchemaGenerator):
+    """Schema generator that leaves the REFERENCES clauses out of FK and M2M columns"""
+
+    def _create_fk_string(self, *args, **kwargs) -> str:
+        return ""
+
+def get_test_schema_sql(conn) -> str:
+    if FAST_SCHEMA:
+        return NoForeignKeySchemaGenerator(conn).get_create_schema_sql(safe=True)
+    return get_schema_sql(conn, safe=True)
+
+# Whether the fixture created the FK-less tables itself (rather than finding them already there)
+fast_schema_created = False
+
+async def create_fast_schema(conn):
+    """What init_db() sets up, but with the FK-less tables, in one transaction"""
+    global fast_schema_created
+    _, rows = await conn.execute_query("SELECT to_regclass('messages') IS NULL AS fresh")
+    await conn.execute_script(f"BEGIN;\n{get_test_schema_sql(conn)}\n{SETUP_SQL}\nCOMMIT;")
+    fast_schema_created = rows[0]["fresh"]
+
+async def get_stored_schema_hash(conn) -> Optional[str]:
     try:
-        success = asyncio.run(test_connection())
-        if success:
-            print("[SUCCESS] Database connection test passed!")
+        _, rows = await conn.execute_query("SELECT hash FROM schema_version LIMIT 1")
+    except OperationalError:  # No schema_version table yet
+        return None
+    return rows[0]["hash"] if rows else None
+
+@pytest_asyncio.fixture(scope="session", loop_scope="session")
+async def db():
+    """Initialized database (Tortoise + asyncpg pool), opened once for the whole test session"""
+    url = unix_socket_url(app.db.DATABASE_URL)
+    if TEMPLATE_DB:
+        url = await clone_template_db(url)
+    app.db.DATABASE_URL = url
+    # asyncio.timeout() rather than wait_for(): init_db() must run in this task, since
+    # Tortoise keeps its connections in a contextvar that a child task would not share
+    async with asyncio.timeout(DB_TIMEOUT):
+        # With FAST_SCHEMA, init_db() must not generate the schema (it still creates the vector
+        # extension): its FK-carrying tables would win over the "CREATE TABLE IF NOT EXISTS" statements
+        await init_db(create_schema=not TEMPLATE_DB and not FAST_SCHEMA)
+        if FAST_SCHEMA and not TEMPLATE_DB:
+            await create_fast_schema(Tortoise.get_connection("default"))
+    logger.info("Successfully connected to the database")
+    yield Tortoise.get_connection("default")
+    await close_db()
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_connection(db):
+    # Test creating the schema: all DDL in one transaction (one commit instead of one per statement),
+    # skipped when the models produce the same SQL as last time. The stored hash and the vector
+    # extension probe are fetched concurrently on two pooled connections.
+    schema_sql = get_test_schema_sql(db)
+    schema_hash = hashlib.sha256(schema_sql.encode()).hexdigest()
+    # (init_db() already checked the extension, so the probe is normally a cache hit)
+    async with asyncio.timeout(DB_TIMEOUT):
+        stored_hash, vector_installed = await asyncio.gather(
+            get_stored_schema_hash(db),
+            _vector_installed(db),
+        )
+        if stored_hash == schema_hash:
+            logger.info("Database schema unchanged, skipping generation")
         else:
-            print("[ERROR] Database connection test failed!")
-            exit(1)
-    except Exception as e:
-        print(f"[ERROR] An error occurred: {e}")
-        exit(1)
+            await db.execute_script(f"BEGIN;\n{schema_sql}\n{SCHEMA_VERSION_SQL.format(hash=schema_hash)}\nCOMMIT;")
+            logger.info("Successfully generated database schema")
+    logger.info("pgvector extension installed: %s", vector_installed)
+
+    assert vector_installed
+    async with asyncio.timeout(DB_TIMEOUT):
+        assert await get_stored_schema_hash(db) == schema_hash
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_fast_schema_has_no_foreign_keys(db):
+    if not fast_schema_created:
+        pytest.skip("Needs PYTEST_FAST_SCHEMA=1 and a database without the tables")
+    async with asyncio.timeout(DB_TIMEOUT):
+        _, rows = await db.execute_query("SELECT count(*) AS n FROM pg_constraint WHERE contype = 'f'")
+    assert rows[0]["n"] == 0
+
+if __name__ == "__main__":
+    raise SystemExit(pytest.main([__file__, "-q"]))
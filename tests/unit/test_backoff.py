@@ -0,0 +1,67 @@
+import asyncio
+
+import pytest
+
+from app.utils import backoff
+from app.utils.backoff import with_backoff
+
+@pytest.fixture(autouse=True)
+def no_sleep(monkeypatch):
+    delays = []
+
+    async def fake_sleep(delay):
+        delays.append(delay)
+
+    monkeypatch.setattr(backoff.asyncio, "sleep", fake_sleep)
+    return delays
+
+def make_flaky(failures, exc=ConnectionError):
+    calls = []
+
+    async def flaky(value):
+        calls.append(value)
+        if len(calls) <= failures:
+            raise exc("boom")
+        return value
+
+    return flaky, calls
+
+def test_retries_until_success(no_sleep):
+    flaky, calls = make_flaky(3)
+    assert asyncio.run(with_backoff(flaky, "ok", base=1.0, cap=60.0)) == "ok"
+    assert len(calls) == 4
+    assert len(no_sleep) == 3
+    # Jitter keeps each delay within [0.5, 1.5] of the exponential step
+    for n, delay in enumerate(no_sleep):
+        assert 0.5 * 2 ** n <= delay <= 1.5 * 2 ** n
+
+def test_reraises_after_max_attempts(no_sleep):
+    flaky, calls = make_flaky(10)
+    with pytest.raises(ConnectionError):
+        asyncio.run(with_backoff(flaky, "ok", max_attempts=3))
+    assert len(calls) == 3
+    assert len(no_sleep) == 2
+
+def test_does_not_retry_other_exceptions(no_sleep):
+    flaky, calls = make_flaky(1, exc=ValueError)
+    with pytest.raises(ValueError):
+        asyncio.run(with_backoff(flaky, "ok", retry_on=(ConnectionError,)))
+    assert len(calls) == 1
+    assert no_sleep == []
+
+def test_long_running_call_resets_backoff(no_sleep, monkeypatch):
+    # Each call "runs" for 100s on a fake clock, longer than cap, so every retry is the first one
+    clock = iter(range(0, 10000, 100))
+    monkeypatch.setattr(backoff.time, "monotonic", lambda: next(clock))
+    flaky, calls = make_flaky(5)
+    assert asyncio.run(with_backoff(flaky, "ok", base=1.0, cap=60.0, max_attempts=3)) == "ok"
+    assert len(calls) == 6
+    assert all(0.5 <= delay <= 1.5 for delay in no_sleep)
+
+class RetryAfter(Exception):
+    retry_after = 7
+
+def test_honours_retry_after(no_sleep):
+    flaky, calls = make_flaky(2, exc=RetryAfter)
+    assert asyncio.run(with_backoff(flaky, "ok", retry_on=(RetryAfter,))) == "ok"
+    assert no_sleep == [7.0, 7.0]
@@ -0,0 +1,75 @@
+import asyncio
+import io
+import os
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import orjson
+
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "test-token")  # app.config refuses to load without it
+
+from app.utils import import_telegram_json as importer
+from app.utils.import_telegram_json import extract_id, iter_batches, parse_message_date, read_chat_header
+
+def export_file(header, messages=()):
+    return io.BytesIO(orjson.dumps({**header, "messages": list(messages)}))
+
+class CountingReader(io.BytesIO):
+    """BytesIO that records how many bytes were read from it"""
+
+    def __init__(self, data):
+        super().__init__(data)
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        data = super().read(size)
+        self.bytes_read += len(data)
+        return data
+
+def test_read_chat_header():
+    f = export_file({"id": 42, "name": "Chat", "type": "private_group"}, [{"id": 1, "type": "message"}])
+    assert read_chat_header(f) == {"id": 42, "name": "Chat", "type": "private_group"}
+
+def test_read_chat_header_stops_at_messages_when_a_field_is_null():
+    data = orjson.dumps({
+        "name": None,
+        "type": "private_group",
+        "id": 42,
+        "messages": [{"id": i, "type": "message", "text": "x" * 100} for i in range(20000)],
+    })
+    f = CountingReader(data)
+    assert read_chat_header(f) == {"type": "private_group", "id": 42}
+    assert f.bytes_read < len(data)
+
+def test_iter_batches():
+    assert list(iter_batches(iter(range(7)), 3)) == [[0, 1, 2], [3, 4, 5], [6]]
+    assert list(iter_batches([], 3)) == []
+
+def test_extract_id():
+    assert extract_id(5) == 5
+    assert extract_id("user123") == 123
+    assert extract_id("channel456") == 456
+    assert extract_id("user123") == 123  # cached
+    assert extract_id("bogus") is None
+    assert extract_id(None) is None
+
+def test_parse_message_date():
+    assert parse_message_date({"date_unixtime": "1704164640"}) == datetime(2024, 1, 2, 3, 4, tzinfo=timezone.utc)
+    # Older exports: naive ISO date, taken as UTC
+    assert parse_message_date({"date": "2024-01-02T03:04:00"}) == datetime(2024, 1, 2, 3, 4, tzinfo=timezone.utc)
+    before = datetime.now(timezone.utc)
+    assert parse_message_date({"id": 1, "date": "not a date"}) >= before
+
+def test_batch_keeps_first_copy_of_repeated_message(monkeypatch):
+    monkeypatch.setattr(
+        importer, "process_message",
+        lambda msg, chat_obj, user_cache: SimpleNamespace(id=msg["id"], text=msg["text"]),
+    )
+    batch = [
+        {"id": 1, "from_id": "user7", "text": "first"},
+        {"id": 2, "from_id": "user7", "text": "other"},
+        {"id": 1, "from_id": "user7", "text": "repeat"},
+    ]
+    # The sender is already cached, so preloading doesn't touch the database
+    processed = asyncio.run(importer.process_messages_batch(batch, None, {7: object()}, {"user": 0}))
+    assert [(m.id, m.text) for m in processed] == [(1, "first"), (2, "other")]
@@ -0,0 +1,71 @@
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+from app.utils.message_formatting import format_entities, format_message_for_display, format_username
+
+DATE = datetime(2024, 1, 2, 3, 4, tzinfo=timezone.utc)
+
+def make_user(user_id, username=None, full_name=None):
+    return SimpleNamespace(id=user_id, username=username, full_name=full_name)
+
+def make_message(message_id=1, text="hello", **fields):
+    values = dict(
+        id=message_id,
+        date=DATE,
+        text=text,
+        entities=None,
+        from_user=make_user(1, username="alice"),
+        forward_from_user=None,
+        forward_from_chat=None,
+        forward_sender_name=None,
+        reply_to_message=None,
+        media=None,
+    )
+    values.update(fields)
+    return SimpleNamespace(**values)
+
+def test_format_plain_message():
+    assert format_message_for_display(make_message()) == "02.01.2024 03:04 alice: hello"
+
+def test_format_forward_reply_and_media():
+    message = make_message(
+        message_id=2,
+        forward_from_user=make_user(2, full_name="Bob Smith"),
+        reply_to_message=SimpleNamespace(id=1, from_user=make_user(3)),
+        media=SimpleNamespace(media_type="photo"),
+    )
+    assert format_message_for_display(message) == "02.01.2024 03:04 alice (forwarded from Bob Smith) (reply to 3): (photo) hello"
+
+def test_forward_from_self_is_not_shown():
+    message = make_message(message_id=3, forward_from_user=make_user(1, username="alice"))
+    assert format_message_for_display(message) == "02.01.2024 03:04 alice: hello"
+
+def test_format_forward_from_chat():
+    message = make_message(message_id=4, forward_from_chat=SimpleNamespace(id=-100, title="News"))
+    assert format_message_for_display(message) == "02.01.2024 03:04 alice (forwarded from chat: News): hello"
+
+def test_cached_result_follows_changed_fields():
+    message = make_message(message_id=5)
+    assert format_message_for_display(message).endswith("alice: hello")
+    message.from_user = make_user(1, username="alice2")
+    message.entities = [{"type": "bold", "offset": 0, "length": 5}]
+    assert format_message_for_display(message) == "02.01.2024 03:04 alice2: **hello**"
+
+def test_format_entities():
+    entities = [
+        {"type": "bold", "offset": 0, "length": 5},
+        {"type": "text_link", "offset": 6, "length": 5, "url": "https://example.com"},
+    ]
+    assert format_entities("hello world", entities) == "**hello** [world](https://example.com)"
+
+def test_format_nested_entities():
+    entities = [
+        {"type": "bold", "offset": 0, "length": 5},
+        {"type": "text_link", "offset": 0, "length": 11, "url": "https://example.com"},
+    ]
+    assert format_entities("hello world", entities) == "[**hello** world](https://example.com)"
+
+def test_format_username_fallbacks():
+    assert format_username(make_user(1, username="alice", full_name="Alice A")) == "alice"
+    assert format_username(make_user(1, full_name="Alice A")) == "Alice A"
+    assert format_username(make_user(1)) == 1